@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Local Analytics Service with Warm In-Memory State
+Usage: python analytics_service.py [--input events.csv] [--host 127.0.0.1] [--port 8765]
+
+  POST /events                     append a batch of raw events (CSV body in the input format)
+  GET  /status                     events, users and date range held in memory
+  GET  /metrics?names=dau,churn    any registered metrics (all when names is omitted)
+  GET  /dau?start=&end=            daily active users per day in a date range
+  GET  /retention?cohort=          cohort retention matrix, or the row of one cohort
+  GET  /features?start=&end=       feature usage within a date range
+"""
+
+import argparse
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from data_processor import DataProcessor
+from metrics_calculator import MetricsCalculator, IncrementalState, resolve_metric_names, select_metrics
+
+
+class AnalyticsService:
+    """Engagement state kept warm in memory, for fast repeated queries
+
+    Each appended batch is processed once and folded into an IncrementalState
+    (per-user active-day bitmaps, DAU/MAU counters, thread summaries, feature
+    totals). Raw events are not kept, so an append costs O(batch). Queries are
+    answered from that state: metric results are rebuilt from it on the first
+    query after a change and then served from memory. Per-day feature counts
+    are updated incrementally per batch, so range queries on them never
+    rescan events.
+    """
+
+    def __init__(self, processor=None, calculator=None):
+        self.processor = processor or DataProcessor()
+        self.calculator = calculator or MetricsCalculator()
+        self.lock = threading.RLock()
+        self.state = IncrementalState()
+        self.daily_features = pd.DataFrame(dtype='int64')
+        self._metrics = None
+
+    def append(self, raw_events):
+        """Process and fold in a raw events frame (the input CSV layout); returns the number of events added"""
+        processed = self.processor.process_frame(raw_events)
+        human = processed[processed['Role'] == 'human']
+        hits = pd.DataFrame(self.calculator.feature_matcher.match(human['Content']),
+                            columns=self.calculator.feature_matcher.features, index=human['Date']).astype('int64')
+
+        with self.lock:
+            self.state.add(processed, hits.sum().to_dict())
+            self.daily_features = self.daily_features.add(hits.groupby(level=0).sum(), fill_value=0).astype('int64')
+            self._metrics = None
+        return len(processed)
+
+    @property
+    def total_events(self):
+        return self.state.total_events
+
+    def metric(self, name):
+        """Result dict of one registered metric"""
+        return self.metrics([name])
+
+    def metrics(self, names=None):
+        """Results of the named metrics (all when names is None), from one consistent snapshot"""
+        names = resolve_metric_names(names)
+        with self.lock:
+            if not self.state.total_users:
+                raise ValueError("No events loaded yet: POST a batch to /events first")
+            if self._metrics is None:
+                self._metrics = self.calculator.calculate_from_state(self.state)
+            return select_metrics(self._metrics, names)
+
+    def status(self):
+        with self.lock:
+            days = list(self.state.dau)
+            return {'events': self.state.total_events, 'users': self.state.total_users,
+                    'first_date': str(min(days)) if days else None,
+                    'last_date': str(max(days)) if days else None}
+
+    def dau(self, start=None, end=None):
+        """Daily active users per ISO date, within [start, end]"""
+        start, end = _iso_day(start, 'start'), _iso_day(end, 'end')
+        return _date_range(self.metric('dau')['dau_data'], start, end)
+
+    def cohort_retention(self, cohort=None):
+        """The cohort retention matrix, or one cohort's size and rates"""
+        matrix = self.metric('cohort_retention')['cohort_retention']
+        if cohort is None:
+            return matrix
+        if cohort not in matrix['cohorts']:
+            raise ValueError(f"Unknown cohort: {cohort} ({matrix['period']} cohorts start on "
+                             f"{', '.join(matrix['cohorts'][:3])}...)")
+        i = matrix['cohorts'].index(cohort)
+        return {'period': matrix['period'], 'cohort': cohort, 'size': matrix['sizes'][i], 'rates': matrix['rates'][i]}
+
+    def feature_usage(self, start=None, end=None):
+        """Messages mentioning each feature within [start, end]"""
+        start, end = _iso_day(start, 'start'), _iso_day(end, 'end')
+        with self.lock:
+            daily = self.daily_features
+            if len(daily):
+                days = pd.Index([str(day) for day in daily.index])
+                daily = daily[(days >= (start or '')) & (days <= (end or '9999'))]
+            totals = daily.sum()
+        return {feature: int(totals.get(feature, 0)) for feature in self.calculator.feature_matcher.features}
+
+
+def _iso_day(value, name):
+    """A start/end query value as an ISO date (None stays None); ValueError if it is not a date"""
+    if value is None:
+        return None
+    try:
+        return pd.Timestamp(value).date().isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid {name} date: {value}") from None
+
+
+def _date_range(series, start=None, end=None):
+    """Entries of a dict keyed by ISO dates that fall within [start, end] (either bound optional)"""
+    return {day: value for day, value in series.items()
+            if (start is None or day >= start) and (end is None or day <= end)}
+
+
+def make_handler(service):
+    """HTTP request handler class answering queries from service"""
+
+    class Handler(BaseHTTPRequestHandler):
+        routes = {
+            '/status': lambda q: service.status(),
+            '/metrics': lambda q: service.metrics(q['names'].split(',') if 'names' in q else None),
+            '/dau': lambda q: service.dau(q.get('start'), q.get('end')),
+            '/retention': lambda q: service.cohort_retention(q.get('cohort')),
+            '/features': lambda q: service.feature_usage(q.get('start'), q.get('end'))
+        }
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path not in self.routes:
+                return self._reply(404, {'error': f"Unknown path: {url.path}"})
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                self._reply(200, self.routes[url.path](query))
+            except ValueError as e:
+                self._reply(400, {'error': str(e)})
+            except Exception as e:
+                self.log_error("%s failed: %r", url.path, e)
+                self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/events':
+                return self._reply(404, {'error': f"Unknown path: {self.path}"})
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                added = service.append(pd.read_csv(io.BytesIO(body)))
+            except (ValueError, KeyError) as e:
+                return self._reply(400, {'error': f"Bad events batch: {e}"})
+            except Exception as e:
+                self.log_error("/events failed: %r", e)
+                return self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+            self._reply(200, {'added': added, 'events': service.total_events})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='User Engagement Analytics service')
+    parser.add_argument('--input', nargs='*', default=[], help='CSV files of events to load at startup')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    args = parser.parse_args()
+
+    service = AnalyticsService()
+    for path in args.input:
+        print(f"📂 Loading data from {path}...")
+        service.append(pd.read_csv(path))
+    status = service.status()
+    print(f"📊 Warm: {status['events']} events from {status['users']} users")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"🚀 Serving on http://{args.host}:{args.port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
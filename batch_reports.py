@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Concurrent Reports for Many Tenants
+Usage: python batch_reports.py manifest.json [--output output/tenants] [--concurrency 8] [--workers 4]
+
+The manifest is a JSON list of {"tenant": name, "input": events CSV} objects
+(an optional "output" overrides <output>/<tenant>).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from data_processor import DataProcessor
+from metrics_calculator import MetricsCalculator, METRICS, resolve_metric_names, select_metrics
+from simple_main_script import write_reports
+
+
+def load_manifest(path, output_root):
+    """Tenant entries of a manifest file, each with its output directory"""
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not all(isinstance(e, dict) and {'tenant', 'input'} <= set(e) for e in entries):
+        raise SystemExit(f"❌ {path}: expected a JSON list of {{\"tenant\": ..., \"input\": ...}} objects")
+    tenants = [e['tenant'] for e in entries]
+    if len(set(tenants)) < len(tenants):
+        raise SystemExit(f"❌ {path}: duplicate tenant names")
+    return [{**e, 'output': e.get('output') or os.path.join(output_root, e['tenant'])} for e in entries]
+
+
+def tenant_metrics(input_path, metric_names):
+    """Worker entry point: process one tenant's events and compute its metrics; returns (metrics, users, events)"""
+    calculator = MetricsCalculator()
+    columns = None if len(metric_names) == len(METRICS) else ['User_ID'] + calculator.required_columns(metric_names)
+    df = DataProcessor().process_csv(input_path, columns=columns)
+    if not len(df):
+        raise ValueError("No events to analyze")
+    metrics = select_metrics(calculator.calculate_metrics(df, metric_names), metric_names)
+    return metrics, int(df['User_ID'].nunique()), len(df)
+
+
+async def run_tenant(entry, pool, limit, metric_names, html_options):
+    """Compute one tenant's metrics on the pool, then write its reports on a thread; returns its status"""
+    status = {'tenant': entry['tenant'], 'input': entry['input'], 'output': entry['output']}
+    async with limit:
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            metrics, users, events = await loop.run_in_executor(pool, tenant_metrics, entry['input'], metric_names)
+            os.makedirs(entry['output'], exist_ok=True)
+            await asyncio.to_thread(write_reports, metrics, entry['output'], users, events, metric_names,
+                                    **html_options)
+            status.update(status='ok', users=users, events=events)
+        except Exception as e:
+            status.update(status='failed', error=f"{type(e).__name__}: {e}")
+        status['seconds'] = round(time.perf_counter() - started, 3)
+    print(f"{'✅' if status['status'] == 'ok' else '❌'} {entry['tenant']} ({status['seconds']:.2f}s)")
+    return status
+
+
+async def run_batch(entries, concurrency, workers, metric_names=None, **html_options):
+    """Reports for every manifest entry, at most concurrency tenants in flight; returns per-tenant statuses"""
+    metric_names = resolve_metric_names(metric_names)
+    limit = asyncio.Semaphore(concurrency)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return await asyncio.gather(*(run_tenant(entry, pool, limit, metric_names, html_options)
+                                      for entry in entries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='User Engagement Analytics for many tenants')
+    parser.add_argument('manifest', help='JSON list of {"tenant": ..., "input": ...} entries')
+    parser.add_argument('--output', default='output/tenants', help='Root directory of per-tenant reports')
+    parser.add_argument('--concurrency', type=int, default=8, help='Tenants in flight at once')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Processes computing metrics')
+    parser.add_argument('--metrics',
+                        help=f"Comma-separated subset of metrics to compute ({', '.join(METRICS)}); default all")
+    parser.add_argument('--offline-report', action='store_true',
+                        help='Draw report charts as inline SVG: no scripts or network access needed to view it')
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    try:
+        metric_names = resolve_metric_names(args.metrics.split(',') if args.metrics else None)
+    except ValueError as e:
+        parser.error(str(e))
+
+    entries = load_manifest(args.manifest, args.output)
+    print(f"🚀 Generating reports for {len(entries)} tenants "
+          f"({args.concurrency} at once, {args.workers} worker processes)...")
+    started = time.perf_counter()
+    statuses = asyncio.run(run_batch(entries, args.concurrency, args.workers, metric_names,
+                                     offline=args.offline_report))
+    elapsed = time.perf_counter() - started
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(f"{args.output}/batch_status.json", 'w') as f:
+        json.dump(statuses, f, indent=2)
+
+    failed = [s for s in statuses if s['status'] != 'ok']
+    slowest = max((s['seconds'] for s in statuses), default=0)
+    print(f"\n🎉 {len(statuses) - len(failed)}/{len(statuses)} tenants in {elapsed:.2f}s "
+          f"(slowest tenant {slowest:.2f}, sum {sum(s['seconds'] for s in statuses):.2f}s)")
+    print(f"📁 Status: {args.output}/batch_status.json")
+    for s in failed:
+        print(f"⚠️  {s['tenant']}: {s['error']}")
+    if failed:
+        raise SystemExit(f"❌ {len(failed)} tenant(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Performance Benchmarks for User Engagement Analytics
+Usage: python benchmark.py {ingestion,sessions} [--rows 1000000 10000000]
+       python benchmark.py pipeline [--users 1000 10000] [--days 30 90] [--results FILE] [--baseline FILE]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from data_processor import DataProcessor, DataGenerator
+from metrics_calculator import MetricsCalculator
+from html_generator import HTMLGenerator
+from profiling import StageProfiler
+
+
+def make_raw_events(rows, seed=0):
+    """Build a raw events frame in the input CSV format without the generator loop"""
+    rng = np.random.default_rng(seed)
+    templates = DataGenerator().templates
+    messages = np.array([json.dumps({'role': 'human', 'content': text})
+                         for texts in templates.values() for text in texts] +
+                        [json.dumps({'role': 'ai', 'content': f"I can help you with {feature}."})
+                         for feature in templates])
+
+    users = max(rows // 60, 1)
+    threads = max(rows // 8, 1)
+    thread_ids = np.sort(rng.integers(0, threads, rows))
+    start = np.datetime64('2024-01-01T00:00:00')
+    seconds = (thread_ids * (365 * 86400 // threads) + rng.integers(0, 600, rows)).astype('timedelta64[s]')
+    dates = np.char.replace(np.datetime_as_string(start + seconds, unit='s'), 'T', ' ')
+
+    return pd.DataFrame({
+        'ID': np.arange(1, rows + 1),
+        'Event Date': dates,
+        'User ID': np.char.add('user_', (thread_ids % users).astype(str)),
+        'Thread ID': np.char.add('thread_', thread_ids.astype(str)),
+        'Message': messages[rng.integers(0, len(messages), rows)]
+    })
+
+
+def _timed(func, *args, **kwargs):
+    """Run func once and return (result, seconds)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_ingestion(rows_list, legacy_sample=50_000):
+    """Compare row-wise and vectorized DataProcessor.process_csv"""
+    processor = DataProcessor()
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in rows_list:
+            path = os.path.join(tmp, f"events_{rows}.csv")
+            make_raw_events(rows).to_csv(path, index=False)
+
+            _, fast = _timed(processor.process_csv, path)
+
+            # The row loop is linear in rows, so time a sample and scale it up
+            sample_rows = min(rows, legacy_sample)
+            sample_path = os.path.join(tmp, f"sample_{sample_rows}.csv")
+            make_raw_events(sample_rows).to_csv(sample_path, index=False)
+            _, sample = _timed(processor.process_csv, sample_path, vectorized=False)
+            legacy = sample * rows / sample_rows
+
+            results.append({'rows': rows, 'vectorized_s': fast, 'legacy_s': legacy,
+                            'legacy_estimated': sample_rows < rows, 'speedup': legacy / fast})
+            print(f"{rows:>12,} rows | vectorized {fast:8.2f}s | "
+                  f"row loop {legacy:10.2f}s{' (est.)' if sample_rows < rows else ''} | "
+                  f"{legacy / fast:6.1f}x")
+
+    return results
+
+
+def _legacy_session_durations(df):
+    """Per-thread boolean-mask loop used by MetricsCalculator before the grouped pass"""
+    session_durations = []
+    for thread_id in df['Thread_ID'].unique():
+        thread_data = df[df['Thread_ID'] == thread_id]
+        if len(thread_data) > 1:
+            duration = (thread_data['Event_Date'].max() -
+                        thread_data['Event_Date'].min()).total_seconds() / 60
+            session_durations.append(duration)
+    return session_durations
+
+
+def bench_sessions(rows_list, legacy_sample=20_000):
+    """Guard the grouped session-duration pass against the per-thread loop"""
+    calculator = MetricsCalculator()
+    processor = DataProcessor()
+    results = []
+
+    for rows in rows_list:
+        df = processor.process_frame(make_raw_events(rows))
+        _, grouped = _timed(calculator._session_durations, df)
+
+        # The loop is O(threads x rows): check equality on a sample and scale quadratically.
+        # Threads starting in the same second may come out in another order, so compare sorted.
+        sample = df.head(min(rows, legacy_sample))
+        expected, sample_time = _timed(_legacy_session_durations, sample)
+        if sorted(calculator._session_durations(sample)) != sorted(expected):
+            raise SystemExit("❌ Grouped session durations differ from the per-thread loop")
+        legacy = sample_time * (rows / len(sample)) ** 2
+
+        results.append({'rows': rows, 'grouped_s': grouped, 'legacy_s': legacy,
+                        'legacy_estimated': len(sample) < rows, 'speedup': legacy / grouped})
+        print(f"{rows:>12,} rows | grouped {grouped:8.2f}s | "
+              f"per-thread loop {legacy:12.2f}s{' (est.)' if len(sample) < rows else ''} | "
+              f"{legacy / grouped:8.1f}x")
+
+    return results
+
+
+def _pipeline_cell(users, days, scenario, seed):
+    """Generate, process, compute every metric and render the report for one dataset size"""
+    profiler = StageProfiler()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.csv')
+        with profiler.stage('generate'):
+            rows, _ = DataGenerator().generate_to_file(path, users=users, days=days, scenario=scenario, seed=seed)
+        with profiler.stage('process_csv'):
+            df = DataProcessor().process_csv(path)
+        with profiler.stage('metrics'):
+            metrics = MetricsCalculator().calculate_all_metrics(
+                df, timer=lambda name: profiler.stage(f'metric:{name}'))
+        with profiler.stage('html_report'):
+            HTMLGenerator().generate_report(metrics, os.path.join(tmp, 'report.html'))
+
+    for stage in profiler.stages.values():
+        stage['rows'] = rows
+        stage['rows_per_s'] = rows / stage['wall_s'] if stage['wall_s'] > 0 else None
+    return {'users': users, 'days': days, 'scenario': scenario, 'rows': rows, 'stages': profiler.stages}
+
+
+def bench_pipeline(users_list, days_list, scenarios, seed=0):
+    """End-to-end stage timings over a users x days x scenario matrix, one fresh process per cell"""
+    results = []
+    for scenario in scenarios:
+        for users in users_list:
+            for days in days_list:
+                # A fresh process per cell keeps peak RSS from leaking between dataset sizes
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    cell = pool.submit(_pipeline_cell, users, days, scenario, seed).result()
+                results.append(cell)
+
+                print(f"{scenario} | {users:,} users x {days} days | {cell['rows']:,} rows")
+                for name, stage in cell['stages'].items():
+                    print(f"  {name:<30} {stage['wall_s']:8.3f}s | peak RSS {stage['peak_rss_mb']:8.1f} MB")
+
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=1.25, min_seconds=0.05):
+    """Pipeline stages that got slower than tolerance x their baseline time (ignoring sub-min_seconds noise)"""
+    previous = {(cell['users'], cell['days'], cell['scenario'], name): stage['wall_s']
+                for cell in baseline['results'] for name, stage in cell['stages'].items()}
+
+    regressions = []
+    for cell in results:
+        for name, stage in cell['stages'].items():
+            before = previous.get((cell['users'], cell['days'], cell['scenario'], name))
+            if before is not None and stage['wall_s'] > max(before * tolerance, before + min_seconds):
+                regressions.append({'users': cell['users'], 'days': cell['days'], 'scenario': cell['scenario'],
+                                    'stage': name, 'baseline_s': before, 'seconds': stage['wall_s']})
+    return regressions
+
+
+BENCHMARKS = {
+    'ingestion': lambda args: bench_ingestion(args.rows),
+    'sessions': lambda args: bench_sessions(args.rows),
+    'pipeline': lambda args: bench_pipeline(args.users, args.days, args.scenarios, args.seed),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='User Engagement Analytics benchmarks')
+    parser.add_argument('benchmark', choices=list(BENCHMARKS), help='Benchmark to run')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000],
+                        help='Dataset sizes (rows) to benchmark')
+    parser.add_argument('--users', type=int, nargs='+', default=[1_000, 10_000], help='Pipeline: users per dataset')
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 90], help='Pipeline: days per dataset')
+    parser.add_argument('--scenarios', nargs='+', default=['standard'], help='Pipeline: generator scenarios')
+    parser.add_argument('--seed', type=int, default=0, help='Pipeline: generator seed')
+    parser.add_argument('--results', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Pipeline: results JSON to compare against (flags slower stages)')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='Pipeline: slowdown factor over the baseline that counts as a regression')
+
+    args = parser.parse_args()
+    if args.baseline and args.benchmark != 'pipeline':
+        parser.error('--baseline is only supported for the pipeline benchmark')
+
+    results = BENCHMARKS[args.benchmark](args)
+
+    if args.results:
+        with open(args.results, 'w') as f:
+            json.dump({'benchmark': args.benchmark, 'created': datetime.now().isoformat(timespec='seconds'),
+                       'results': results}, f, indent=2)
+        print(f"📁 Results: {args.results}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"⚠️  {r['scenario']} {r['users']:,}x{r['days']} {r['stage']}: "
+                  f"{r['baseline_s']:.3f}s -> {r['seconds']:.3f}s")
+        if regressions:
+            raise SystemExit(f"❌ {len(regressions)} stage(s) regressed beyond {args.tolerance}x the baseline")
+        print("✅ No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
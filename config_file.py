@@ -3,16 +3,29 @@
 # Retention periods to analyze (days)
 RETENTION_PERIODS = [1, 7, 30]
 
+# Trailing windows (days) for rolling active-user series; 7 is WAU
+ROLLING_WINDOWS = [7, 28, 30]
+
+# Trailing window (days) of the monthly actives in DAU/MAU stickiness
+STICKINESS_WINDOW = 30
+
+# Cohort granularity of the retention matrix: 'day', 'week' (starting Monday) or 'month'
+COHORT_PERIOD = 'week'
+
 # Days of inactivity to consider user churned
 CHURN_THRESHOLD_DAYS = 30
 
-# Keywords to identify feature usage
+# Keywords to identify feature usage (a message is labelled with the first matching feature;
+# keywords match at word starts, and ones under 4 letters only as whole words)
 FEATURE_KEYWORDS = {
-    "search": ["search", "find", "lookup"],
-    "analysis": ["analyze", "analysis", "report"], 
-    "export": ["export", "download", "save"],
-    "chat": ["chat", "conversation", "talk"],
-    "help": ["help", "support", "assistance"]
+    "search": ["search", "find", "lookup", "locate"],
+    "analysis": ["analyze", "analysis", "report", "trend", "insight"],
+    "export": ["export", "download", "save", "pdf", "excel"],
+    "chat": ["hello", "hi", "chat", "talk", "conversation"],
+    "help": ["help", "support", "assistance", "guide", "how"],
+    "api": ["api", "integration", "endpoint"],
+    "reporting": ["report", "dashboard", "kpi", "summary"],
+    "automation": ["automate", "schedule", "alert", "workflow"]
 }
 
 # Chart settings
@@ -3,15 +3,110 @@ Data Processor and Generator for User Engagement Metrics
 """
 
 import pandas as pd
+import hashlib
 import json
 import numpy as np
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from event_cache import EventCache
+from event_index import CsvTimeIndex, date_bounds
+from event_encoding import IdEncoder, compact_events
+from feature_matcher import FeatureMatcher
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = pq = None
+
+
+def _decode_message(raw):
+    """Decode one Message cell, returning None when it is not a JSON object"""
+    try:
+        message = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def _parse_event_dates(values):
+    """Parse the Event Date column in one call, retrying odd formats per value"""
+    parsed = pd.to_datetime(values, errors='coerce')
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed = parsed.astype(object)
+        parsed[retry] = [pd.to_datetime(v, errors='coerce') for v in values[retry]]
+        parsed = pd.to_datetime(parsed)
+    return parsed
+
+
+# Resolution of parsed Event Dates (ns before pandas 3, us since), matched by generated events
+EVENT_DATE_DTYPE = _parse_event_dates(pd.Series(['1970-01-01 00:00:00'])).dtype
+
+
+# Raw CSV column each processed column comes from. 'Event Date' and 'Message'
+# are always read, since they decide which rows are valid.
+SOURCE_COLUMNS = {
+    'ID': 'ID', 'Event_Date': 'Event Date', 'User_ID': 'User ID', 'Thread_ID': 'Thread ID',
+    'Role': 'Message', 'Content': 'Message', 'Date': 'Event Date', 'Hour': 'Event Date',
+    'Month': 'Event Date', 'Feature': 'Message'
+}
+
+
+def _raw_columns(columns):
+    """Raw CSV columns to read for the given processed columns (None = all)"""
+    if columns is None:
+        return None
+    return ['Event Date', 'Message'] + sorted({SOURCE_COLUMNS[c] for c in columns} - {'Event Date', 'Message'})
+
 
 class DataProcessor:
-    def process_csv(self, file_path):
-        """Load and process CSV file"""
-        df = pd.read_csv(file_path)
+    def __init__(self, cache_dir=None, compact=False):
+        self.feature_matcher = FeatureMatcher()
+        self.cache = None
+        if cache_dir:
+            # Cached Feature labels depend on the compiled keyword patterns, not just the keyword table
+            patterns = [pattern.pattern for pattern in self.feature_matcher.patterns]
+            fingerprint = hashlib.sha256(json.dumps([self.feature_matcher.features, patterns]).encode()).hexdigest()
+            self.cache = EventCache(cache_dir, fingerprint=fingerprint)
+
+        # Compact mode: int32 ID codes (decode with self.encoders[column].decode), categoricals, day numbers
+        self.compact = compact
+        self.encoders = {'User_ID': IdEncoder(), 'Thread_ID': IdEncoder()}
+
+    def process_csv(self, file_path, vectorized=True, columns=None, start=None, end=None):
+        """Load and process CSV file (via the processed-events cache when enabled)
+
+        columns limits the processed columns (Event_Date is always kept) and
+        the raw columns read; with the cache enabled the full frame is built
+        and cached, then narrowed. start/end (inclusive ISO dates) keep only
+        events in that range and are pushed down into reading: the cache skips
+        Parquet row groups outside it, and without the cache a sidecar
+        CsvTimeIndex limits parsing to the CSV blocks that overlap it.
+        """
+        lower, upper = date_bounds(start, end)
+        ranged = lower is not None or upper is not None
+        processed = self.cache.load(file_path, lower, upper) if self.cache is not None else None
+
+        if processed is None:
+            if self.cache is None and vectorized:
+                usecols = _raw_columns(columns)
+                raw = (CsvTimeIndex(file_path, _parse_event_dates).read(lower, upper, usecols) if ranged
+                       else pd.read_csv(file_path, usecols=usecols))
+                processed = self.process_frame(raw, columns, start, end)
+            else:
+                df = pd.read_csv(file_path)
+                processed = self.process_frame(df) if vectorized else self._process_rows(df)
+                if self.cache is not None:
+                    self.cache.save(file_path, processed)
+                processed = _in_range(processed, lower, upper)
+
+        processed = _select_columns(processed, columns)
+        return compact_events(processed, self.encoders) if self.compact else processed
+
+    def _process_rows(self, df):
+        """Row-by-row reference implementation of process_frame"""
         processed_data = []
 
         for _, row in df.iterrows():
@@ -36,24 +131,88 @@ class DataProcessor:
 
         return pd.DataFrame(processed_data).sort_values('Event_Date')
 
+    def iter_csv(self, file_path, chunksize=500_000, columns=None, start=None, end=None):
+        """Stream a CSV file as processed chunks of at most chunksize rows (only events in [start, end])"""
+        lower, upper = date_bounds(start, end)
+        if lower is not None or upper is not None:
+            index = CsvTimeIndex(file_path, _parse_event_dates)
+            chunks = index.iter_frames(lower, upper, chunksize=chunksize, usecols=_raw_columns(columns))
+        else:
+            chunks = pd.read_csv(file_path, chunksize=chunksize, usecols=_raw_columns(columns))
+        for chunk in chunks:
+            processed = self.process_frame(chunk, columns, start, end)
+            if not len(processed):
+                continue  # e.g. every event of the chunk is outside [start, end]
+            yield compact_events(processed, self.encoders) if self.compact else processed
+
+    def iter_generated(self, generator, chunksize=500_000, columns=None, csv_path=None, start=None, end=None,
+                       **params):
+        """Processed chunks straight from a DataGenerator, skipping the CSV round trip (chunksize=None: one frame)"""
+        lower, upper = date_bounds(start, end)
+        for processed in generator.iter_processed(chunksize=chunksize, columns=columns, csv_path=csv_path, **params):
+            processed = _in_range(processed, lower, upper)
+            yield compact_events(processed, self.encoders) if self.compact else processed
+
+    def process_frame(self, df, columns=None, start=None, end=None):
+        """Process a raw events frame column-wise (same result as the row loop), building only columns
+
+        With start/end (inclusive ISO dates), rows outside the range are
+        dropped before their messages are decoded.
+        """
+        event_dates = _parse_event_dates(df['Event Date'])
+        lower, upper = date_bounds(start, end)
+        if lower is not None or upper is not None:
+            in_range = _in_range(event_dates, lower, upper).index
+            df, event_dates = df.loc[in_range], event_dates.loc[in_range]
+        messages = df['Message'].map(_decode_message)
+
+        # Rows the row loop would skip: bad JSON, unparseable dates, non-text content
+        contents = messages.map(lambda m: m.get('content', '') if m is not None else None)
+        valid = contents.map(lambda c: isinstance(c, str)).astype(bool) & event_dates.notna()
+
+        df = df[valid].reset_index(drop=True)
+        messages = messages[valid].reset_index(drop=True)
+        contents = contents[valid].reset_index(drop=True).infer_objects()
+        event_dates = event_dates[valid].reset_index(drop=True)
+
+        builders = {
+            'ID': lambda: df['ID'],
+            'Event_Date': lambda: event_dates,
+            'User_ID': lambda: df['User ID'],
+            'Thread_ID': lambda: df['Thread ID'],
+            'Role': lambda: messages.map(lambda m: m.get('role', '')).infer_objects(),
+            'Content': lambda: contents,
+            'Date': lambda: event_dates.dt.date,
+            'Hour': lambda: event_dates.dt.hour.astype('int64'),
+            'Month': lambda: event_dates.dt.to_period('M'),
+            'Feature': lambda: self.feature_matcher.label(contents)
+        }
+        processed = pd.DataFrame({name: build() for name, build in builders.items()
+                                  if columns is None or name in columns or name == 'Event_Date'})
+        return processed.sort_values('Event_Date')
+
     def _extract_feature(self, content):
         """Extract feature from content"""
-        content_lower = content.lower()
-        keywords = {
-            'search': ['search', 'find', 'lookup', 'locate'],
-            'analysis': ['analyze', 'analysis', 'report', 'trend', 'insight'],
-            'export': ['export', 'download', 'save', 'pdf', 'excel'],
-            'chat': ['hello', 'hi', 'chat', 'talk', 'conversation'],
-            'help': ['help', 'support', 'assistance', 'guide', 'how'],
-            'api': ['api', 'integration', 'endpoint'],
-            'reporting': ['report', 'dashboard', 'kpi', 'summary'],
-            'automation': ['automate', 'schedule', 'alert', 'workflow']
-        }
+        return self.feature_matcher.first(content)
+
+
+def _in_range(events, lower, upper):
+    """Events (a processed frame, or a Series of event dates) with Event_Date in [lower, upper)"""
+    dates = events['Event_Date'] if isinstance(events, pd.DataFrame) else events
+    keep = pd.Series(True, index=dates.index)
+    if lower is not None:
+        keep &= dates >= lower
+    if upper is not None:
+        keep &= dates < upper
+    return events if keep.all() else events[keep]
+
+
+def _select_columns(processed, columns):
+    """Processed frame narrowed to columns (plus Event_Date), in their usual order"""
+    if columns is None:
+        return processed
+    return processed[[c for c in processed.columns if c in columns or c == 'Event_Date']]
 
-        for feature, words in keywords.items():
-            if any(word in content_lower for word in words):
-                return feature
-        return 'other'
 
 class DataGenerator:
     def __init__(self):
@@ -74,8 +233,255 @@ class DataGenerator:
             'automation': ["Automate workflow", "Schedule reports", "Set alerts"]
         }
 
-    def generate(self, users=500, days=90, scenario='standard'):
+    def generate(self, users=500, days=90, scenario='standard', seed=None, vectorized=True):
         """Generate realistic chatbot data with different scenarios"""
+        if vectorized:
+            parts = list(self._iter_day_parts(users, days, scenario, seed))
+            return self._interactions_frame(parts, list(self.templates))
+
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+        return self._generate_rows(users, days, scenario)
+
+    def iter_generate(self, users=500, days=90, scenario='standard', seed=None, chunksize=500_000):
+        """Yield the generated data as raw frames of about chunksize rows (whole days are never split)"""
+        features = list(self.templates)
+        for parts, first_id in self._iter_part_batches(users, days, scenario, seed, chunksize):
+            yield self._interactions_frame(parts, features, first_id)
+
+    def iter_processed(self, users=500, days=90, scenario='standard', seed=None, chunksize=500_000,
+                       columns=None, csv_path=None):
+        """Yield the generated data already processed (the DataProcessor.process_frame layout)
+
+        Builds typed columns directly from the generated arrays, so no dates are
+        formatted and re-parsed and no messages JSON-encoded and decoded. With
+        csv_path the raw chunks are also written to that CSV on a background
+        thread while the caller consumes the processed ones; write errors are
+        raised when the generator finishes or is closed.
+        """
+        features = list(self.templates)
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            written = None
+            try:
+                for i, (parts, first_id) in enumerate(self._iter_part_batches(users, days, scenario, seed,
+                                                                              chunksize)):
+                    if csv_path:
+                        # At most one raw chunk waits for the writer, so memory stays bounded
+                        if written is not None:
+                            written.result()
+                        written = writer.submit(self._append_csv, csv_path, parts, features, first_id, i == 0)
+                    yield self._events_frame(parts, features, first_id, columns)
+            finally:
+                # Also on early close: the last write finishes and its errors are raised
+                if written is not None:
+                    written.result()
+
+    def _iter_part_batches(self, users, days, scenario, seed, chunksize):
+        """Day parts grouped into batches of about chunksize rows, with the first message ID of each"""
+        parts, rows, first_id = [], 0, 1
+
+        for part in self._iter_day_parts(users, days, scenario, seed):
+            parts.append(part)
+            rows += 2 * len(part['asked'])
+            if chunksize is not None and rows >= chunksize:
+                yield parts, first_id
+                parts, first_id, rows = [], first_id + rows, 0
+
+        if parts or first_id == 1:
+            yield parts, first_id
+
+    def _append_csv(self, file_path, parts, features, first_id, first):
+        self._interactions_frame(parts, features, first_id).to_csv(
+            file_path, mode='w' if first else 'a', header=first, index=False)
+
+    def generate_to_file(self, file_path, users=500, days=90, scenario='standard', seed=None,
+                         chunksize=500_000):
+        """Stream generated data to a CSV (or .parquet) file chunk by chunk; returns (rows, users)"""
+        chunks = self.iter_generate(users, days, scenario, seed, chunksize)
+        rows, user_ids = 0, set()
+
+        if file_path.endswith('.parquet'):
+            if pq is None:
+                raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+            writer = None
+            try:
+                for chunk in chunks:
+                    table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(file_path, table.schema)
+                    writer.write_table(table)
+                    rows += len(chunk)
+                    user_ids.update(chunk['User ID'].unique())
+            finally:
+                if writer is not None:
+                    writer.close()
+        else:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(file_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+                rows += len(chunk)
+                user_ids.update(chunk['User ID'].unique())
+
+        return rows, len(user_ids)
+
+    def _iter_day_parts(self, users, days, scenario, seed):
+        """NumPy-batched generation: one vectorized draw per day over all users, yielding per-query arrays"""
+        rng = np.random.default_rng(seed)
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+        params = self._get_scenario_params(scenario)
+
+        # Create users
+        type_names = list(self.user_types)
+        types = rng.choice(len(type_names), size=users, p=[ut['weight'] for ut in self.user_types.values()])
+        join_day = rng.exponential(days / 4, size=users).astype(np.int64)
+        activity = rng.uniform(0.5, 1.0, size=users) * params['activity_boost']
+        retention = np.array([self.user_types[t]['retention'] for t in type_names])[types]
+        query_range = np.array([self.user_types[t]['queries'] for t in type_names])[types]
+
+        features = list(self.templates)
+        feature_choices = self._feature_choices(params, features)
+        is_power = types == type_names.index('power')
+        off_hours = np.array(list(range(0, 9)) + list(range(18, 24)))
+
+        day_starts = pd.date_range(start_date, end_date, freq='D').normalize()
+        msg_id = 1
+
+        for day, day_start in enumerate(day_starts):
+            # Activity probability with scenario modifiers
+            days_since_join = day - join_day
+            weekend_factor = 0.3 if day_start.weekday() >= 5 else 1.0
+            activity_prob = (retention * params['decay_rate'] ** np.maximum(days_since_join, 0)
+                             * activity * weekend_factor)
+            active = (days_since_join >= 0) & (rng.random(users) < activity_prob)
+            sessions = np.where(active, rng.integers(0, params['max_sessions'] + 1, size=users), 0)
+            if not sessions.any():
+                continue
+
+            # Sessions: owner, ordinal within the user-day, start time and query count
+            session_user = np.repeat(np.arange(users), sessions)
+            session_number = np.arange(len(session_user)) - np.repeat(np.cumsum(sessions) - sessions, sessions)
+            business = rng.random(len(session_user)) < params['business_hours_weight']
+            hour = np.where(business, rng.integers(9, 18, size=len(session_user)),
+                            off_hours[rng.integers(0, len(off_hours), size=len(session_user))])
+            start_seconds = (hour * 3600 + rng.integers(0, 60, size=len(session_user)) * 60
+                             + rng.integers(0, 60, size=len(session_user)))
+            queries = rng.integers(query_range[session_user, 0], query_range[session_user, 1] + 1)
+            first_ids = msg_id + 2 * (np.cumsum(queries) - queries)
+            msg_id += 2 * int(queries.sum())
+
+            # Queries: each is a human message, a 5-60s pause, an AI reply, then a 30-180s pause
+            query_session = np.repeat(np.arange(len(queries)), queries)
+            reply_gap = rng.integers(5, 61, size=len(query_session))
+            step = reply_gap + rng.integers(30, 181, size=len(query_session))
+            elapsed = np.cumsum(step) - step
+            elapsed -= np.repeat(elapsed[np.cumsum(queries) - queries], queries)
+            asked = start_seconds[query_session] + elapsed
+
+            if feature_choices['power'] is not None:
+                pool = np.where(is_power[session_user[query_session]], 1, 0)
+            else:
+                pool = np.zeros(len(query_session), dtype=np.int64)
+            feature = self._draw_features(rng, feature_choices, pool)
+
+            yield {
+                'user': session_user[query_session],
+                'thread_first_id': first_ids[query_session],
+                'thread_number': session_number[query_session],
+                'day_start': np.full(len(query_session), day_start.to_datetime64().astype('datetime64[s]')),
+                'asked': asked,
+                'answered': asked + reply_gap,
+                'feature': feature,
+                'template': (rng.random(len(query_session)) *
+                             np.array([len(self.templates[f]) for f in features])[feature]).astype(np.int64)
+            }
+
+    def _feature_choices(self, params, features):
+        """Feature index pools per scenario: 'default' for everyone, 'power' for power users if any"""
+        distribution = params['feature_distribution']
+        all_features = np.arange(len(features))
+        if distribution == 'power_features':
+            power = np.array([features.index(f) for f in ['analysis', 'api', 'automation', 'reporting']])
+            return {'default': all_features, 'power': power}
+        if distribution == 'basic_features':
+            return {'default': np.array([features.index(f) for f in ['help', 'chat', 'search']]), 'power': None}
+        return {'default': all_features, 'power': None}
+
+    def _draw_features(self, rng, feature_choices, pool):
+        """Uniform feature draw from each query's pool (0 = default, 1 = power users)"""
+        feature = feature_choices['default'][rng.integers(0, len(feature_choices['default']), size=len(pool))]
+        if feature_choices['power'] is not None:
+            power = pool == 1
+            feature[power] = feature_choices['power'][rng.integers(0, len(feature_choices['power']), size=power.sum())]
+        return feature
+
+    def _interactions_frame(self, parts, features, first_id=1):
+        """Interleave human/AI messages from per-query arrays into the raw CSV layout"""
+        columns = ['ID', 'Event Date', 'User ID', 'Thread ID', 'Message']
+        if not parts:
+            return pd.DataFrame(columns=columns)
+
+        messages, times, message_index, user_ids, thread_ids = self._interaction_arrays(parts, features)
+        encoded = np.array([json.dumps(message) for message in messages])
+
+        return pd.DataFrame({
+            'ID': np.arange(first_id, first_id + len(times)),
+            'Event Date': pd.Series(np.datetime_as_string(times, unit='s')).str.replace('T', ' ', regex=False),
+            'User ID': user_ids,
+            'Thread ID': thread_ids,
+            'Message': encoded[message_index]
+        }, columns=columns)
+
+    def _events_frame(self, parts, features, first_id=1, columns=None):
+        """Processed events (as DataProcessor.process_frame builds them) from per-query arrays"""
+        if not parts:
+            return DataProcessor().process_frame(self._interactions_frame(parts, features), columns)
+
+        messages, times, message_index, user_ids, thread_ids = self._interaction_arrays(parts, features)
+        roles = np.array([message['role'] for message in messages], dtype=object)
+        contents = np.array([message['content'] for message in messages], dtype=object)
+        event_dates = pd.Series(times).astype(EVENT_DATE_DTYPE)
+
+        builders = {
+            'ID': lambda: np.arange(first_id, first_id + len(times)),
+            'Event_Date': lambda: event_dates,
+            'User_ID': lambda: user_ids,
+            'Thread_ID': lambda: thread_ids,
+            'Role': lambda: roles[message_index],
+            'Content': lambda: contents[message_index],
+            'Date': lambda: event_dates.dt.date,
+            'Hour': lambda: event_dates.dt.hour.astype('int64'),
+            'Month': lambda: event_dates.dt.to_period('M'),
+            'Feature': lambda: FeatureMatcher().label(contents)[message_index]
+        }
+        processed = pd.DataFrame({name: build() for name, build in builders.items()
+                                  if columns is None or name in columns or name == 'Event_Date'})
+        return processed.sort_values('Event_Date')
+
+    def _interaction_arrays(self, parts, features):
+        """Distinct message dicts, plus per-row timestamps, message indexes, user IDs and thread IDs"""
+        q = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        human_messages = [[{'role': 'human', 'content': text} for text in self.templates[f]] for f in features]
+        offsets = np.cumsum([0] + [len(texts) for texts in human_messages])[:-1]
+        messages = [m for texts in human_messages for m in texts] + [
+            {'role': 'ai', 'content': f"I can help you with {f}. Here's the information you need."}
+            for f in features
+        ]
+
+        times = np.empty(2 * len(q['asked']), dtype='datetime64[s]')
+        times[0::2] = q['day_start'] + q['asked'].astype('timedelta64[s]')
+        times[1::2] = q['day_start'] + q['answered'].astype('timedelta64[s]')
+        message_index = np.empty(len(times), dtype=np.int64)
+        message_index[0::2] = offsets[q['feature']] + q['template']
+        message_index[1::2] = offsets[-1] + len(human_messages[-1]) + q['feature']
+
+        user_ids = 'user_' + pd.Series(np.repeat(q['user'] + 1, 2)).astype(str).str.zfill(4)
+        thread_ids = 'thread_' + (pd.Series(np.repeat(q['thread_first_id'], 2)).astype(str) + '_' +
+                                  pd.Series(np.repeat(q['thread_number'], 2)).astype(str))
+        return messages, times, message_index, user_ids, thread_ids
+
+    def _generate_rows(self, users, days, scenario):
+        """Row-by-row reference implementation of _iter_day_parts"""
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
 
@@ -0,0 +1,96 @@
+"""
+Columnar On-Disk Cache of Processed Events
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (Parquet engine for pandas)
+except ImportError:
+    pyarrow = None
+
+CATEGORICAL_COLUMNS = ['User_ID', 'Thread_ID', 'Role', 'Feature']
+
+# Rows per Parquet row group: events are sorted by time, so each group's
+# Event_Date min/max statistics let time-range loads skip whole groups
+ROW_GROUP_SIZE = 100_000
+
+
+class EventCache:
+    """Parquet cache of DataProcessor output, keyed by the source CSV
+
+    An entry is valid while the source file keeps its path, size and
+    modification time. If only the mtime changed, the content hash decides,
+    so a touched-but-identical file is still a hit. The fingerprint (e.g. a
+    hash of the keyword table) invalidates entries built with other settings.
+    """
+
+    def __init__(self, cache_dir, fingerprint=''):
+        if pyarrow is None:
+            raise ImportError("The processed-events cache needs pyarrow: pip install pyarrow")
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, file_path, start=None, end=None):
+        """Return the cached processed frame for file_path (events in [start, end) only), or None if missing or stale"""
+        data_path, meta_path = self._paths(file_path)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        stat = os.stat(file_path)
+        if meta['size'] != stat.st_size or meta['fingerprint'] != self.fingerprint:
+            return None
+        if meta['mtime_ns'] != stat.st_mtime_ns:
+            if meta['sha256'] != _file_digest(file_path):
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            self._write_meta(meta_path, meta)
+
+        filters = ([('Event_Date', '>=', start)] if start is not None else []) + \
+                  ([('Event_Date', '<', end)] if end is not None else [])
+        df = pd.read_parquet(data_path, filters=filters or None)
+        for column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype(df[column].cat.categories.dtype)
+        return df
+
+    def save(self, file_path, df):
+        """Store the processed frame for file_path with categorical-encoded ID/label columns"""
+        data_path, meta_path = self._paths(file_path)
+        stat = os.stat(file_path)
+        meta = {
+            'source': os.path.abspath(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_digest(file_path),
+            'fingerprint': self.fingerprint
+        }
+
+        encoded = df.astype({column: 'category' for column in CATEGORICAL_COLUMNS})
+        encoded.to_parquet(data_path + '.tmp', row_group_size=ROW_GROUP_SIZE)
+        os.replace(data_path + '.tmp', data_path)
+        self._write_meta(meta_path, meta)
+
+    def _paths(self, file_path):
+        """Cache data and metadata paths for a source file"""
+        key = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()[:16]
+        base = os.path.join(self.cache_dir, f"{os.path.basename(file_path)}.{key}")
+        return base + '.parquet', base + '.json'
+
+    def _write_meta(self, meta_path, meta):
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+def _file_digest(file_path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
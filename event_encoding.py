@@ -0,0 +1,72 @@
+"""
+Compact Encoding of Processed Events
+"""
+
+import numpy as np
+import pandas as pd
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class IdEncoder:
+    """Dictionary encoder from string IDs to int32 codes, stable across chunks
+
+    New IDs get the next free code in order of first appearance, so codes from
+    different chunks of the same file (or later files) can be grouped together.
+    """
+
+    def __init__(self):
+        self.ids = pd.Index([], dtype=object)
+
+    def encode(self, values):
+        """int32 code of every value, extending the dictionary with unseen IDs"""
+        codes = self.ids.get_indexer(values)
+        unseen = codes < 0
+        if unseen.any():
+            new_codes, new_ids = pd.factorize(values[unseen])
+            codes[unseen] = new_codes + len(self.ids)
+            self.ids = self.ids.append(pd.Index(new_ids, dtype=object))
+        return codes.astype(np.int32)
+
+    def decode(self, codes):
+        """Original IDs of an array of codes"""
+        return self.ids[np.asarray(codes)]
+
+
+def compact_events(df, encoders, keep_content=True):
+    """Compact form of a processed events frame (any subset of its columns)
+
+    User_ID and Thread_ID become int32 codes from encoders, Role, Feature and
+    Content become categoricals (Content is dropped unless keep_content), Date
+    becomes int32 days since 1970-01-01 and Month int32 months since 1970-01.
+    """
+    days = df['Event_Date'].to_numpy(dtype='datetime64[D]')
+    encoded = {
+        'ID': lambda: df['ID'].to_numpy(),
+        'Event_Date': lambda: df['Event_Date'].to_numpy(),
+        'User_ID': lambda: encoders['User_ID'].encode(df['User_ID']),
+        'Thread_ID': lambda: encoders['Thread_ID'].encode(df['Thread_ID']),
+        'Role': lambda: df['Role'].astype('category').array,
+        'Content': lambda: df['Content'].astype('category').array,
+        'Date': lambda: (days - EPOCH).astype(np.int32),
+        'Hour': lambda: df['Hour'].to_numpy(dtype=np.int8),
+        'Month': lambda: days.astype('datetime64[M]').astype(np.int32),
+        'Feature': lambda: df['Feature'].astype('category').array
+    }
+    return pd.DataFrame({column: encoded[column]() for column in df.columns
+                         if column != 'Content' or keep_content})
+
+
+def is_compact(df):
+    """Whether a processed frame uses the compact_events encoding"""
+    return pd.api.types.is_integer_dtype(df['Date'])
+
+
+def days_to_dates(days):
+    """datetime.date values for int day numbers"""
+    return list((EPOCH + np.asarray(days, dtype='timedelta64[D]')).astype(object))
+
+
+def months_to_periods(months):
+    """Monthly Periods for int month numbers"""
+    return pd.PeriodIndex(np.asarray(months, dtype=np.int64).astype('datetime64[M]'), freq='M')
@@ -0,0 +1,150 @@
+"""
+Sidecar Timestamp Index for Time-Range Reads of Event CSVs
+"""
+
+import io
+import json
+import os
+import pandas as pd
+
+
+class CsvTimeIndex:
+    """Byte offsets and Event Date min/max of fixed-size row blocks of an events CSV
+
+    Stored next to the CSV as <file>.timeindex.json and rebuilt when the file's
+    size or modification time changes. A time-range read then only reads and
+    parses the blocks whose [min, max] overlaps the range; the rest of the file
+    is never tokenized or JSON-decoded. Blocks end on record boundaries, so
+    quoted fields spanning several lines (e.g. pretty-printed JSON messages)
+    never straddle two blocks.
+    """
+
+    def __init__(self, file_path, parse_dates=pd.to_datetime, block_rows=100_000):
+        self.file_path = file_path
+        self.parse_dates = parse_dates
+        self.block_rows = block_rows
+        self.index_path = file_path + '.timeindex.json'
+        self.header, self.blocks = self._load() or self._build()
+
+    def iter_frames(self, start=None, end=None, chunksize=None, usecols=None):
+        """Raw frames (of at most chunksize rows) from the blocks that may hold events in [start, end)"""
+        ranges = self._ranges(start, end)
+        if not ranges:
+            yield pd.read_csv(io.BytesIO(self.header), usecols=usecols)
+            return
+        with open(self.file_path, 'rb') as f:
+            reader = _RangeReader(f, self.header, ranges)
+            if chunksize is None:
+                yield pd.read_csv(reader, usecols=usecols)
+            else:
+                yield from pd.read_csv(reader, chunksize=chunksize, usecols=usecols)
+
+    def read(self, start=None, end=None, usecols=None):
+        """One raw frame of the blocks that may hold events in [start, end)"""
+        return next(self.iter_frames(start, end, usecols=usecols))
+
+    def _ranges(self, start, end):
+        """Byte ranges of the overlapping blocks, adjacent blocks merged"""
+        ranges = []
+        for offset, length, first, last in self.blocks:
+            if first is None or (end is not None and pd.Timestamp(first) >= end) or \
+                    (start is not None and pd.Timestamp(last) < start):
+                continue
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1][1] += length
+            else:
+                ranges.append([offset, length])
+        return ranges
+
+    def _load(self):
+        """Header and blocks from the sidecar, or None if missing or stale"""
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path) as f:
+            index = json.load(f)
+        stat = os.stat(self.file_path)
+        if index['size'] != stat.st_size or index['mtime_ns'] != stat.st_mtime_ns \
+                or index['block_rows'] != self.block_rows:
+            return None
+        return index['header'].encode(), index['blocks']
+
+    def _build(self):
+        """Scan the CSV once, recording each block's byte range and Event Date min/max"""
+        blocks = []
+        with open(self.file_path, 'rb') as f:
+            header = f.readline()
+            offset = f.tell()
+            while True:
+                data = b''.join(_read_records(f, self.block_rows))
+                if not data:
+                    break
+                dates = self.parse_dates(pd.read_csv(io.BytesIO(header + data), usecols=['Event Date'])['Event Date'])
+                valid = dates.notna().any()
+                blocks.append([offset, len(data), str(dates.min()) if valid else None,
+                               str(dates.max()) if valid else None])
+                offset += len(data)
+
+        stat = os.stat(self.file_path)
+        index = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'block_rows': self.block_rows,
+                 'header': header.decode(), 'blocks': blocks}
+        try:
+            with open(self.index_path, 'w') as f:
+                json.dump(index, f)
+        except OSError:
+            pass  # read-only location: use the index for this run only
+        return header, blocks
+
+
+def _read_records(f, count):
+    """Lines of the next count CSV records (fewer at end of file)
+
+    A line ends a record only when the record's quote count is even: inside
+    a quoted field newlines are data, and escaped quotes come in pairs.
+    """
+    lines, records, quotes = [], 0, 0
+    while records < count:
+        line = f.readline()
+        if not line:
+            break
+        lines.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            records += 1
+    return lines
+
+
+class _RangeReader(io.RawIOBase):
+    """Read-only file object yielding a CSV header followed by selected byte ranges of a file"""
+
+    def __init__(self, f, header, ranges):
+        self.f = f
+        self.pieces = [header] + [(offset, length) for offset, length in ranges]
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.pieces:
+            piece = self.pieces[0]
+            if isinstance(piece, tuple):
+                offset, length = piece
+                self.f.seek(offset)
+                data = self.f.read(min(length, len(buffer)))
+                remaining = (offset + len(data), length - len(data)) if 0 < len(data) < length else None
+            else:
+                data, remaining = piece[:len(buffer)], piece[len(buffer):]
+            if remaining:
+                self.pieces[0] = remaining
+            else:
+                self.pieces.pop(0)
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+        return 0
+
+
+def date_bounds(start=None, end=None):
+    """[lower, upper) Timestamps for inclusive ISO start/end dates (either optional)"""
+    lower = pd.Timestamp(start) if start else None
+    upper = pd.Timestamp(end) + pd.Timedelta(days=1) if end else None
+    return lower, upper
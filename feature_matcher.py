@@ -0,0 +1,55 @@
+"""
+Keyword Feature Matcher shared by DataProcessor and MetricsCalculator
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from config_file import FEATURE_KEYWORDS
+
+
+class FeatureMatcher:
+    def __init__(self, keywords=FEATURE_KEYWORDS):
+        self.features = list(keywords)
+        self.patterns = [re.compile('|'.join(_keyword_pattern(word) for word in words))
+                         for words in keywords.values()]
+
+    def match(self, contents):
+        """Boolean matrix (messages x features) of which features each message mentions"""
+        # Repeated messages are common, so lowercase and scan each distinct text once
+        codes, uniques = pd.factorize(pd.Series(contents, dtype=object), use_na_sentinel=False)
+        lowered = pd.Series(uniques, dtype=object).str.lower()
+
+        hits = np.zeros((len(uniques), len(self.features)), dtype=bool)
+        for i, pattern in enumerate(self.patterns):
+            hits[:, i] = lowered.str.contains(pattern, na=False).to_numpy(dtype=bool)
+        return hits[codes]
+
+    def label(self, contents, default='other'):
+        """First matching feature for each message, in keyword-table order"""
+        hits = self.match(contents)
+        labels = np.array(self.features + [default], dtype=object)
+        return labels[np.where(hits.any(axis=1), hits.argmax(axis=1), len(self.features))]
+
+    def first(self, content, default='other'):
+        """First matching feature of a single message (non-str content raises, like str.lower)"""
+        text = content.lower()
+        for feature, pattern in zip(self.features, self.patterns):
+            if pattern.search(text):
+                return feature
+        return default
+
+    def count(self, contents):
+        """Number of messages mentioning each feature"""
+        return dict(zip(self.features, self.match(contents).sum(axis=0).tolist()))
+
+
+def _keyword_pattern(word):
+    """Regex for one keyword, anchored at a word start so it never matches inside another word
+
+    Keywords of 4+ letters also match inflected forms (report -> reports,
+    reporting); shorter ones ("hi", "how", "api") must be whole words, since
+    as prefixes they would match "his", "however" and the like.
+    """
+    word = re.escape(word.lower())
+    return rf'\b{word}\b' if len(word) < 4 else rf'\b{word}'
@@ -3,14 +3,45 @@ Professional HTML Report Generator with Enhanced Visualizations
 """
 
 from datetime import datetime
+import gzip
 import json
+import os
+import numpy as np
+
+# Most recent cohorts shown in the heatmap of a lightweight report
+LIGHT_COHORTS = 24
+
+CHART_JS_URL = 'https://cdnjs.cloudflare.com/ajax/libs/Chart.js/3.9.1/chart.min.js'
+BAR_COLORS = ['rgba(102, 126, 234, 0.8)', 'rgba(118, 75, 162, 0.8)', 'rgba(129, 140, 248, 0.8)',
+              'rgba(139, 92, 246, 0.8)', 'rgba(124, 58, 237, 0.8)']
+
 
 class HTMLGenerator:
-    def generate_report(self, metrics, output_path):
-        """Generate a professional HTML report with charts and modern design"""
+    def generate_report(self, metrics, output_path, max_points=None, data_file=False, offline=False):
+        """Generate a professional HTML report with charts and modern design
+
+        By default the DAU chart shows the last 30 days. With max_points it
+        shows the whole history downsampled (LTTB) to at most max_points
+        points, and the cohort heatmap only the latest LIGHT_COHORTS cohorts,
+        so the report stays small however long the history. With data_file the
+        chart data goes to a gzipped <report>.data.json.gz sidecar that the
+        page fetches after it renders (the report must then be served over
+        HTTP; browsers block fetch from file:// pages). With offline the charts
+        are drawn server-side as inline SVG and the report loads no scripts at
+        all, so it renders instantly without network access.
+        """
+        if offline and data_file:
+            raise ValueError("An offline report embeds its charts and cannot use a data file")
 
         # Prepare data for charts
-        dau_dates = list(metrics['dau_data'].keys())[-30:]  # Last 30 days
+        if max_points:
+            dau_dates = list(metrics['dau_data'].keys())
+            keep = _lttb_indexes(list(metrics['dau_data'].values()), max_points)
+            dau_dates = [dau_dates[i] for i in keep]
+            dau_title = f"Daily Active Users Trend ({len(metrics['dau_data'])} Days)"
+        else:
+            dau_dates = list(metrics['dau_data'].keys())[-30:]  # Last 30 days
+            dau_title = "Daily Active Users Trend (Last 30 Days)"
         dau_values = [metrics['dau_data'][d] for d in dau_dates]
 
         # Feature usage data
@@ -21,6 +52,20 @@ class HTMLGenerator:
         total_users = len(set([k for k in metrics.get('mau_data', {}).values()]))
         total_interactions = sum(metrics['dau_data'].values()) * metrics['avg_queries_per_session']
 
+        chart_data = {'dau': {'labels': dau_dates, 'values': dau_values},
+                      'features': {'labels': [f.title() for f in features], 'values': feature_values}}
+        if offline:
+            load_charts = None
+        elif data_file:
+            data_path = os.path.splitext(output_path)[0] + '.data.json.gz'
+            with gzip.open(data_path, 'wt') as f:
+                json.dump(chart_data, f, separators=(',', ':'))
+            load_charts = (f"fetch({json.dumps(os.path.basename(data_path))})"
+                           ".then(response => new Response(response.body.pipeThrough("
+                           "new DecompressionStream('gzip'))).json()).then(renderCharts);")
+        else:
+            load_charts = f"renderCharts({json.dumps(chart_data)});"
+
         html = f"""
 <!DOCTYPE html>
 <html>
@@ -28,7 +73,7 @@ class HTMLGenerator:
     <title>User Engagement Analytics Dashboard</title>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/Chart.js/3.9.1/chart.min.js"></script>
+    {'' if offline else f'<script src="{CHART_JS_URL}"></script>'}
     <style>
         * {{ margin: 0; padding: 0; box-sizing: border-box; }}
         
@@ -274,6 +319,32 @@ class HTMLGenerator:
             font-size: 0.8rem;
         }}
         
+        /* Cohort Retention Heatmap */
+        .cohort-wrapper {{
+            overflow-x: auto;
+        }}
+        
+        .cohort-table {{
+            border-collapse: collapse;
+            font-size: 0.8rem;
+            white-space: nowrap;
+        }}
+        
+        .cohort-table th, .cohort-table td {{
+            padding: 0.4rem 0.6rem;
+            text-align: center;
+            border: 1px solid #0f0f23;
+        }}
+        
+        .cohort-table th {{
+            color: #888;
+            font-weight: 500;
+        }}
+        
+        .cohort-table td {{
+            color: #fff;
+        }}
+        
         /* Status Indicators */
         .status {{
             display: inline-flex;
@@ -454,10 +525,10 @@ class HTMLGenerator:
         <!-- Daily Active Users Chart -->
         <div class="chart-container">
             <div class="chart-header">
-                <h3 class="chart-title">Daily Active Users Trend (Last 30 Days)</h3>
+                <h3 class="chart-title">{dau_title}</h3>
             </div>
             <div class="chart-wrapper">
-                <canvas id="dauChart"></canvas>
+                {self._svg_line_chart(dau_dates, dau_values) if offline else '<canvas id="dauChart"></canvas>'}
             </div>
         </div>
         
@@ -470,122 +541,176 @@ class HTMLGenerator:
                 {self._generate_feature_cards(metrics['feature_usage'])}
             </div>
             <div class="chart-wrapper" style="margin-top: 2rem;">
-                <canvas id="featureChart"></canvas>
+                {self._svg_bar_chart(chart_data['features']['labels'], feature_values) if offline else '<canvas id="featureChart"></canvas>'}
             </div>
         </div>
         
+        {self._generate_cohort_section(metrics.get('cohort_retention'), LIGHT_COHORTS if max_points else None)}
+        
         <!-- Footer -->
         <div class="footer">
             <p>Powered by User Engagement Analytics Platform • {datetime.now().year}</p>
         </div>
     </div>
     
+    {'' if offline else self._generate_chart_script(load_charts)}
+</body>
+</html>
+"""
+
+        # Save HTML file
+        with open(output_path, 'w') as f:
+            f.write(html)
+
+        return output_path
+
+    def _generate_chart_script(self, load_charts):
+        """Generate the Chart.js code that draws the DAU and feature charts"""
+        return f"""
     <script>
         // Chart.js configuration
         Chart.defaults.color = '#888';
         Chart.defaults.borderColor = '#2a2a3e';
         
-        // Daily Active Users Chart
-        const dauCtx = document.getElementById('dauChart').getContext('2d');
-        new Chart(dauCtx, {{
-            type: 'line',
-            data: {{
-                labels: {json.dumps(dau_dates)},
-                datasets: [{{
-                    label: 'Daily Active Users',
-                    data: {json.dumps(dau_values)},
-                    borderColor: '#667eea',
-                    backgroundColor: 'rgba(102, 126, 234, 0.1)',
-                    borderWidth: 3,
-                    pointRadius: 5,
-                    pointBackgroundColor: '#667eea',
-                    pointBorderColor: '#fff',
-                    pointBorderWidth: 2,
-                    tension: 0.4,
-                    fill: true
-                }}]
-            }},
-            options: {{
-                responsive: true,
-                maintainAspectRatio: false,
-                plugins: {{
-                    legend: {{ display: false }},
-                    tooltip: {{
-                        backgroundColor: '#1a1a2e',
-                        titleColor: '#e0e0e0',
-                        bodyColor: '#e0e0e0',
+        function renderCharts(data) {{
+            // Daily Active Users Chart
+            const dauCtx = document.getElementById('dauChart').getContext('2d');
+            new Chart(dauCtx, {{
+                type: 'line',
+                data: {{
+                    labels: data.dau.labels,
+                    datasets: [{{
+                        label: 'Daily Active Users',
+                        data: data.dau.values,
                         borderColor: '#667eea',
-                        borderWidth: 1,
-                        cornerRadius: 8,
-                        displayColors: false
-                    }}
+                        backgroundColor: 'rgba(102, 126, 234, 0.1)',
+                        borderWidth: 3,
+                        pointRadius: data.dau.values.length > 60 ? 0 : 5,
+                        pointBackgroundColor: '#667eea',
+                        pointBorderColor: '#fff',
+                        pointBorderWidth: 2,
+                        tension: 0.4,
+                        fill: true
+                    }}]
                 }},
-                scales: {{
-                    x: {{
-                        grid: {{ color: '#2a2a3e' }},
-                        ticks: {{ maxRotation: 45, minRotation: 45 }}
+                options: {{
+                    responsive: true,
+                    maintainAspectRatio: false,
+                    plugins: {{
+                        legend: {{ display: false }},
+                        tooltip: {{
+                            backgroundColor: '#1a1a2e',
+                            titleColor: '#e0e0e0',
+                            bodyColor: '#e0e0e0',
+                            borderColor: '#667eea',
+                            borderWidth: 1,
+                            cornerRadius: 8,
+                            displayColors: false
+                        }}
                     }},
-                    y: {{
-                        grid: {{ color: '#2a2a3e' }},
-                        beginAtZero: true
+                    scales: {{
+                        x: {{
+                            grid: {{ color: '#2a2a3e' }},
+                            ticks: {{ maxRotation: 45, minRotation: 45 }}
+                        }},
+                        y: {{
+                            grid: {{ color: '#2a2a3e' }},
+                            beginAtZero: true
+                        }}
                     }}
                 }}
-            }}
-        }});
-        
-        // Feature Usage Chart
-        const featureCtx = document.getElementById('featureChart').getContext('2d');
-        new Chart(featureCtx, {{
-            type: 'bar',
-            data: {{
-                labels: {json.dumps([f.title() for f in features])},
-                datasets: [{{
-                    label: 'Usage Count',
-                    data: {json.dumps(feature_values)},
-                    backgroundColor: [
-                        'rgba(102, 126, 234, 0.8)',
-                        'rgba(118, 75, 162, 0.8)',
-                        'rgba(129, 140, 248, 0.8)',
-                        'rgba(139, 92, 246, 0.8)',
-                        'rgba(124, 58, 237, 0.8)'
-                    ],
-                    borderWidth: 0,
-                    borderRadius: 8
-                }}]
-            }},
-            options: {{
-                responsive: true,
-                maintainAspectRatio: false,
-                plugins: {{
-                    legend: {{ display: false }},
-                    tooltip: {{
-                        backgroundColor: '#1a1a2e',
-                        titleColor: '#e0e0e0',
-                        bodyColor: '#e0e0e0',
-                        borderColor: '#667eea',
-                        borderWidth: 1,
-                        cornerRadius: 8
-                    }}
+            }});
+        
+            // Feature Usage Chart
+            const featureCtx = document.getElementById('featureChart').getContext('2d');
+            new Chart(featureCtx, {{
+                type: 'bar',
+                data: {{
+                    labels: data.features.labels,
+                    datasets: [{{
+                        label: 'Usage Count',
+                        data: data.features.values,
+                        backgroundColor: {json.dumps(BAR_COLORS)},
+                        borderWidth: 0,
+                        borderRadius: 8
+                    }}]
                 }},
-                scales: {{
-                    x: {{ grid: {{ display: false }} }},
-                    y: {{
-                        grid: {{ color: '#2a2a3e' }},
-                        beginAtZero: true
+                options: {{
+                    responsive: true,
+                    maintainAspectRatio: false,
+                    plugins: {{
+                        legend: {{ display: false }},
+                        tooltip: {{
+                            backgroundColor: '#1a1a2e',
+                            titleColor: '#e0e0e0',
+                            bodyColor: '#e0e0e0',
+                            borderColor: '#667eea',
+                            borderWidth: 1,
+                            cornerRadius: 8
+                        }}
+                    }},
+                    scales: {{
+                        x: {{ grid: {{ display: false }} }},
+                        y: {{
+                            grid: {{ color: '#2a2a3e' }},
+                            beginAtZero: true
+                        }}
                     }}
                 }}
-            }}
-        }});
+            }});
+        }}
+
+        {load_charts}
     </script>
-</body>
-</html>
 """
 
-        # Save HTML file
-        with open(output_path, 'w') as f:
-            f.write(html)
+    def _svg_line_chart(self, labels, values, width=1000, height=300):
+        """Server-side SVG line chart (with gridlines and date labels) of a series"""
+        if not values:
+            return ''
+        left, bottom, top = 50, 40, 10
+        peak = max(max(values), 1)
+        xs = [left + (width - left - 10) * i / max(len(values) - 1, 1) for i in range(len(values))]
+        ys = [top + (height - top - bottom) * (1 - value / peak) for value in values]
+        points = ' '.join(f'{x:.1f},{y:.1f}' for x, y in zip(xs, ys))
 
-        return output_path
+        grid = []
+        for i in range(5):
+            y = top + (height - top - bottom) * i / 4
+            grid.append(f'<line x1="{left}" y1="{y:.1f}" x2="{width - 10}" y2="{y:.1f}" stroke="#2a2a3e"/>'
+                        f'<text x="{left - 8}" y="{y + 4:.1f}" text-anchor="end">{peak * (4 - i) / 4:,.0f}</text>')
+        for i in sorted({round(j * (len(labels) - 1) / 5) for j in range(6)}):
+            grid.append(f'<text x="{xs[i]:.1f}" y="{height - 12}" text-anchor="middle">{labels[i]}</text>')
+        markers = ''.join(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="4" fill="#667eea" stroke="#fff" stroke-width="2">'
+                          f'<title>{label}: {value:,}</title></circle>'
+                          for x, y, label, value in zip(xs, ys, labels, values)) if len(values) <= 60 else ''
+
+        return f"""<svg viewBox="0 0 {width} {height}" width="100%" height="100%" fill="#888" font-size="12">
+                    {''.join(grid)}
+                    <polygon points="{xs[0]:.1f},{height - bottom} {points} {xs[-1]:.1f},{height - bottom}" fill="rgba(102, 126, 234, 0.1)"/>
+                    <polyline points="{points}" fill="none" stroke="#667eea" stroke-width="3"/>
+                    {markers}
+                </svg>"""
+
+    def _svg_bar_chart(self, labels, values, width=1000, height=300):
+        """Server-side SVG bar chart, one bar per label"""
+        if not values:
+            return ''
+        bottom, top = 30, 20
+        peak = max(max(values), 1)
+        slot = width / len(values)
+        bars = []
+        for i, (label, value) in enumerate(zip(labels, values)):
+            bar_height = (height - top - bottom) * value / peak
+            x, y = i * slot + slot * 0.15, height - bottom - bar_height
+            bars.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{slot * 0.7:.1f}" height="{bar_height:.1f}" rx="8" '
+                        f'fill="{BAR_COLORS[i % len(BAR_COLORS)]}"><title>{label}: {value:,}</title></rect>'
+                        f'<text x="{x + slot * 0.35:.1f}" y="{y - 6:.1f}" text-anchor="middle">{value:,}</text>'
+                        f'<text x="{x + slot * 0.35:.1f}" y="{height - 10}" text-anchor="middle">{label}</text>')
+
+        return f"""<svg viewBox="0 0 {width} {height}" width="100%" height="100%" fill="#888" font-size="12">
+                    {''.join(bars)}
+                </svg>"""
 
     def _generate_feature_cards(self, feature_usage):
         """Generate feature cards HTML"""
@@ -598,4 +723,69 @@ class HTMLGenerator:
                     <div class="feature-label">interactions</div>
                 </div>
             """)
-        return ''.join(cards)
\ No newline at end of file
+        return ''.join(cards)
+
+    def _generate_cohort_section(self, cohort_retention, max_cohorts=None):
+        """Generate the cohort retention heatmap (empty without cohort data), optionally max_cohorts x max_cohorts"""
+        if not cohort_retention or not cohort_retention['cohorts']:
+            return ''
+        if max_cohorts:
+            cohort_retention = {key: value[-max_cohorts:] if isinstance(value, list) else value
+                                for key, value in cohort_retention.items()}
+            cohort_retention['rates'] = [rates[:max_cohorts] for rates in cohort_retention['rates']]
+
+        period = cohort_retention['period'].title()
+        title = {'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}[cohort_retention['period']]
+        width = max(len(rates) for rates in cohort_retention['rates'])
+        header = ''.join(f'<th>{period} {n}</th>' for n in range(width))
+        rows = []
+        for cohort, size, rates in zip(cohort_retention['cohorts'], cohort_retention['sizes'],
+                                       cohort_retention['rates']):
+            cells = ''.join(f'<td style="background: rgba(102, 126, 234, {0.1 + 0.9 * rate:.2f})">{rate:.0%}</td>'
+                            for rate in rates)
+            rows.append(f'<tr><th>{cohort}</th><th>{size:,}</th>{cells}</tr>')
+
+        return f"""
+        <!-- Cohort Retention -->
+        <div class="chart-container">
+            <div class="chart-header">
+                <h3 class="chart-title">{title} Cohort Retention</h3>
+            </div>
+            <div class="cohort-wrapper">
+                <table class="cohort-table">
+                    <tr><th>Cohort</th><th>Users</th>{header}</tr>
+                    {''.join(rows)}
+                </table>
+            </div>
+        </div>
+        """
+
+
+def _lttb_indexes(values, threshold):
+    """Indexes of at most threshold points of a series that keep its shape (Largest-Triangle-Three-Buckets)
+
+    Keeps the first and last point and, from each of threshold - 2 equal
+    buckets in between, the point forming the largest triangle with the point
+    kept from the previous bucket and the average of the next bucket. Below 3
+    points there are no buckets: 2 keeps the ends, 1 only the latest point.
+    """
+    y = np.asarray(values, dtype=np.float64)
+    n = len(y)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][2 - threshold:] if threshold > 0 else []
+
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    kept = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = (end + next_end - 1) / 2, y[end:next_end].mean()
+        a = kept[-1]
+        x = np.arange(start, end)
+        areas = np.abs((a - next_x) * (y[start:end] - y[a]) - (a - x) * (next_y - y[a]))
+        kept.append(int(start + areas.argmax()))
+    kept.append(n - 1)
+    return kept
@@ -0,0 +1,156 @@
+"""
+HyperLogLog Sketches for Approximate Distinct User Counts
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _hash_users(user_ids):
+    """Stable 64-bit hashes of user IDs (identical across processes and runs)"""
+    return pd.util.hash_array(np.asarray(user_ids, dtype=object))
+
+
+def _bit_length(values):
+    """Vectorized int.bit_length for uint64 arrays"""
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = values >= np.uint64(1 << shift)
+        lengths[wide] += shift
+        values[wide] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+def _register_updates(hashes, precision):
+    """Register index and rank (leading zeros + 1 of the remaining bits) for each hash"""
+    width = 64 - precision
+    index = (hashes >> np.uint64(width)).astype(np.int64)
+    rank = width + 1 - _bit_length(hashes & np.uint64((1 << width) - 1))
+    return index, rank.astype(np.uint8)
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch with 2**precision one-byte registers
+
+    The relative standard error of count() is about 1.04 / sqrt(2**precision):
+    1.6% at precision 12 (4 KB), 0.8% at 14 (16 KB), 0.4% at 16 (64 KB).
+    Small cardinalities fall back to linear counting and are near exact.
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def add(self, user_ids):
+        """Add a batch of user IDs"""
+        index, rank = _register_updates(_hash_users(user_ids), self.precision)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one (set union)"""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches of precision {self.precision} and {other.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        """Estimated number of distinct users added"""
+        return _estimate(self.registers[np.newaxis, :])[0]
+
+
+class ActiveUserSketches:
+    """One HyperLogLog per period (day or month) of user activity
+
+    Per-period sketches merge across chunks and workers, and trailing windows
+    (weekly or 28-day actives) are unions of daily sketches, so none of them
+    needs another pass over raw events.
+    """
+
+    def __init__(self, precision=12):
+        HyperLogLog(precision)  # validate
+        self.precision = precision
+        self.periods = []
+        self.registers = np.zeros((0, 1 << precision), dtype=np.uint8)
+
+    def add(self, periods, user_ids):
+        """Add events given as parallel arrays of period labels and user IDs"""
+        codes, labels = pd.factorize(pd.Series(periods), sort=True)
+        rows = self._rows(labels)
+        index, rank = _register_updates(_hash_users(user_ids), self.precision)
+        flat = self.registers.reshape(-1)
+        np.maximum.at(flat, rows[codes] * self.registers.shape[1] + index, rank)
+        return self
+
+    def merge(self, other):
+        """Fold another ActiveUserSketches of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge sketches of precision {self.precision} and {other.precision}")
+        rows = self._rows(other.periods)
+        np.maximum.at(self.registers, rows, other.registers)
+        return self
+
+    def sketch(self, period):
+        """The HyperLogLog of one period (empty if the period was never seen)"""
+        result = HyperLogLog(self.precision)
+        if period in self.periods:
+            result.registers[:] = self.registers[self.periods.index(period)]
+        return result
+
+    def counts(self):
+        """Estimated distinct users per period, sorted by period"""
+        order = np.argsort(np.array(self.periods, dtype=object), kind='stable')
+        estimates = _estimate(self.registers[order])
+        return pd.Series(estimates, index=[self.periods[i] for i in order], dtype='int64')
+
+    def rolling(self, days):
+        """Estimated distinct users over the trailing `days` calendar days ending on each day (7 = WAU)
+
+        Covers every calendar day from the first to the last period, indexed by
+        datetime.date. Only meaningful when the periods are dates or day numbers
+        (days since 1970-01-01) of daily sketches.
+        """
+        order = np.argsort(np.array(self.periods, dtype=object), kind='stable')
+        labels = [self.periods[i] for i in order]
+        day_numbers = np.array(labels, dtype=np.int64 if isinstance(labels[0], (int, np.integer)) else 'datetime64[D]')
+        day_numbers = day_numbers.astype(np.int64)
+        registers = self.registers[order]
+
+        calendar = np.arange(day_numbers[0], day_numbers[-1] + 1)
+        starts = np.searchsorted(day_numbers, calendar - (days - 1), side='left')
+        ends = np.searchsorted(day_numbers, calendar, side='right')
+        # One union at a time keeps memory at one sketch rather than one per calendar day
+        estimates = np.zeros(len(calendar), dtype=np.int64)
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            if end > start:
+                estimates[i] = _estimate(registers[start:end].max(axis=0)[np.newaxis, :])[0]
+        return pd.Series(estimates, index=calendar.astype('datetime64[D]').astype(object))
+
+    def _rows(self, labels):
+        """Register rows for period labels, appending rows for new periods"""
+        positions = {period: i for i, period in enumerate(self.periods)}
+        new = [label for label in labels if label not in positions]
+        for label in new:
+            positions[label] = len(self.periods)
+            self.periods.append(label)
+        if new:
+            self.registers = np.vstack([self.registers, np.zeros((len(new), self.registers.shape[1]), dtype=np.uint8)])
+        return np.array([positions[label] for label in labels], dtype=np.int64)
+
+
+def _estimate(registers):
+    """HyperLogLog cardinality estimate for each row of registers (with small-range correction)"""
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.power(2.0, -registers.astype(np.float64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    estimates = np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+    return np.rint(estimates).astype(np.int64)
@@ -2,88 +2,815 @@
 Simple Metrics Calculator for User Engagement
 """
 
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import numpy as np
 import pandas as pd
 from datetime import timedelta
+from config_file import RETENTION_PERIODS, ROLLING_WINDOWS, STICKINESS_WINDOW, COHORT_PERIOD
+from feature_matcher import FeatureMatcher
+from hyperloglog import ActiveUserSketches
+from event_encoding import is_compact, days_to_dates, months_to_periods
+
+# Columns of the shared per-(user, thread) summary table
+THREAD_COLUMNS = ['User_ID', 'Thread_ID', 'Event_Date', 'Role']
+
+# Metric registry, in report order: processed columns each metric reads, the
+# shared intermediates it uses (computed once per run) and the keys it returns
+METRICS = {
+    'dau': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days', 'day_sketches'],
+            'keys': ['avg_dau', 'dau_data']},
+    'mau': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days'], 'keys': ['avg_mau', 'mau_data']},
+    'session_duration': {'columns': THREAD_COLUMNS, 'uses': ['threads', 'per_thread'],
+                         'keys': ['session_durations', 'avg_session_duration']},
+    'session_frequency': {'columns': THREAD_COLUMNS, 'uses': ['threads'], 'keys': ['avg_sessions_per_user']},
+    'queries_per_session': {'columns': THREAD_COLUMNS, 'uses': ['threads', 'per_thread'],
+                            'keys': ['avg_queries_per_session']},
+    'feature_usage': {'columns': ['Role', 'Content'], 'uses': [], 'keys': ['feature_usage']},
+    'retention': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days', 'users'], 'keys': ['retention_rates']},
+    'churn': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days', 'users'], 'keys': ['churn_rate']},
+    'rolling_actives': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days', 'day_sketches'],
+                        'keys': ['avg_wau', 'rolling_actives']},
+    'stickiness': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days'],
+                   'keys': ['avg_stickiness', 'stickiness_data']},
+    'retention_curve': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days', 'users'],
+                        'keys': ['retention_curve']},
+    'cohort_retention': {'columns': ['User_ID', 'Event_Date'], 'uses': ['user_days'], 'keys': ['cohort_retention']},
+}
+
+# Columns EventAggregates needs that are cheap to pickle; workers rebuild Date unless it is compact
+SHARD_COLUMNS = ['User_ID', 'Thread_ID', 'Event_Date', 'Role', 'Content', 'Month']
+
 
 class MetricsCalculator:
-    def __init__(self):
-        self.feature_keywords = {
-            "search": ["search", "find", "lookup"],
-            "analysis": ["analyze", "analysis", "report"], 
-            "export": ["export", "download", "save"],
-            "chat": ["chat", "conversation", "talk"],
-            "help": ["help", "support", "assistance"]
-        }
+    def __init__(self, hll_precision=None):
+        self.feature_matcher = FeatureMatcher()
+        self.hll_precision = hll_precision
     
-    def calculate_all_metrics(self, df):
-        """Calculate all engagement metrics"""
+    def calculate_all_metrics(self, df, timer=None):
+        """Calculate all engagement metrics (timer(name), if given, wraps each numbered metric)"""
+        return self.calculate_metrics(df, timer=timer)
+
+    def calculate_metrics(self, df, names=None, timer=None):
+        """Calculate the named metrics from METRICS (all when names is None), sharing intermediates"""
+        names = resolve_metric_names(names)
+        timer = timer or (lambda name: nullcontext())
+        shared = _SharedIntermediates(self, df)
+
         metrics = {}
-        
+        for i, name in enumerate(names):
+            with timer(name):
+                metrics.update(getattr(self, f'_metric_{name}')(df, shared))
+            # Free intermediates that no remaining metric uses
+            shared.release(keep={use for later in names[i + 1:] for use in METRICS[later]['uses']})
+        return metrics
+
+    def calculate_segmented(self, df, by, user_attributes=None):
+        """All metrics for every value of each segment column: {column: {value: metrics}}
+
+        by names event columns (e.g. Feature, Hour) or columns of
+        user_attributes, a frame indexed by User_ID that is joined onto the
+        events (users without a value are left out). Results equal
+        calculate_all_metrics on the filtered events, but each column takes a
+        single grouped pass: distinct (segment, user, day) keys, per-segment
+        thread summaries and feature counts are built once over all events,
+        and each segment's metrics come from its slice of those summaries.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        if user_attributes is not None and not user_attributes.index.is_unique:
+            repeated = user_attributes.index[user_attributes.index.duplicated()].unique()
+            raise ValueError(f"User attributes repeat users: {', '.join(map(str, repeated[:5]))}"
+                             f"{'...' if len(repeated) > 5 else ''}")
+        for column in by:
+            if column not in df and (user_attributes is None or column not in user_attributes):
+                raise ValueError(f"Unknown segment column: {column}")
+
+        user_codes, _ = pd.factorize(df['User_ID'])
+        events = pd.DataFrame({'User_ID': user_codes, 'Thread_ID': pd.factorize(df['Thread_ID'])[0],
+                               'Event_Date': df['Event_Date'].to_numpy(), 'Role': df['Role'].to_numpy()})
+        days = df['Event_Date'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+        human = events['Role'].to_numpy() == 'human'
+        hits = self.feature_matcher.match(df.loc[human, 'Content'])
+
+        return {column: self._segment_metrics(
+                    (df[column] if column in df else df['User_ID'].map(user_attributes[column])).to_numpy(),
+                    events, days, human, hits)
+                for column in by}
+
+    def _segment_metrics(self, values, events, days, human, hits):
+        """Metrics per distinct value of one segment array (parallel to events)"""
+        segments, labels = pd.factorize(values, sort=True)
+        keep = (segments >= 0) & (events['User_ID'].to_numpy() >= 0)  # factorize codes missing values as -1
+        user_count = int(events['User_ID'].max()) + 1 if len(events) else 1
+
+        # Distinct (segment, user, day) triples, sorted, with each segment's slice bounds
+        keys, user_days = _user_day_arrays(
+            segments[keep].astype(np.int64) * user_count + events['User_ID'].to_numpy()[keep], days[keep])
+        bounds = np.searchsorted(keys // user_count, np.arange(len(labels) + 1))
+
+        threads = _summarize_threads(events[keep], segments=segments[keep])
+        per_thread = _per_thread(threads, segmented=True)
+        threads, per_thread = ({code: group.droplevel('Segment')
+                                for code, group in frame.groupby(level='Segment', sort=False)}
+                               for frame in (threads, per_thread))
+        features = pd.DataFrame(hits, columns=self.feature_matcher.features).groupby(segments[human]).sum()
+
+        segmented = {}
+        for code, label in enumerate(labels):
+            rows = slice(bounds[code], bounds[code + 1])
+            user_codes, active_days = keys[rows] % user_count, user_days[rows]
+            new_user = np.r_[True, user_codes[1:] != user_codes[:-1]]
+            last_day = np.r_[new_user[1:], True]
+            months = _period_numbers(active_days, 'month')
+            new_month = new_user | np.r_[True, months[1:] != months[:-1]]
+
+            dau_days, dau_counts = np.unique(active_days, return_counts=True)
+            mau_months, mau_counts = np.unique(months[new_month], return_counts=True)
+            segmented[str(label)] = self._calculate_from_summaries(
+                dau_data=pd.Series(dau_counts, index=dau_days),
+                mau_data=pd.Series(mau_counts, index=mau_months),
+                threads=threads[code],
+                feature_usage=(features.loc[code].to_dict() if code in features.index
+                               else dict.fromkeys(self.feature_matcher.features, 0)),
+                first_dates=pd.Series(active_days[new_user], index=user_codes[new_user]),
+                last_dates=pd.Series(active_days[last_day], index=user_codes[new_user]),
+                user_days=(user_codes, active_days),
+                per_thread=per_thread[code]
+            )
+        return segmented
+
+    def required_columns(self, names=None):
+        """Processed columns the named metrics read"""
+        columns = []
+        for name in resolve_metric_names(names):
+            columns += [column for column in METRICS[name]['columns'] if column not in columns]
+        return columns
+
+    def _metric_dau(self, df, shared):
+        """1. Daily Active Users (DAU)"""
+        if self.hll_precision:
+            dau_data = shared['day_sketches'].counts()
+        else:
+            dau_data = _users_per_period(*shared['user_days'], 'day')
+        dau_data = _label_days(dau_data)
+        return {'avg_dau': dau_data.mean(),
+                'dau_data': {str(k): v for k, v in dau_data.to_dict().items()}}
+
+    def _metric_mau(self, df, shared):
+        """2. Monthly Active Users (MAU)"""
+        if self.hll_precision:
+            months = _period_numbers(_day_numbers(df['Event_Date']), 'month')
+            mau_data = ActiveUserSketches(self.hll_precision).add(months, df['User_ID']).counts()
+        else:
+            mau_data = _users_per_period(*shared['user_days'], 'month')
+        mau_data = _label_months(mau_data)
+        return {'avg_mau': mau_data.mean(),
+                'mau_data': {str(k): v for k, v in mau_data.to_dict().items()}}
+
+    def _metric_session_duration(self, df, shared):
+        """3. Session Duration"""
+        session_durations = _session_minutes(shared['per_thread'])
+        return {'session_durations': session_durations,
+                'avg_session_duration': sum(session_durations) / len(session_durations) if session_durations else 0}
+
+    def _metric_session_frequency(self, df, shared):
+        """4. Session Frequency (Sessions per User)"""
+        sessions_per_user = shared['threads'].groupby(level='User_ID').size()
+        return {'avg_sessions_per_user': sessions_per_user.mean()}
+
+    def _metric_queries_per_session(self, df, shared):
+        """5. Queries per Session"""
+        per_thread = shared['per_thread']
+        return {'avg_queries_per_session': per_thread.loc[per_thread['Queries'] > 0, 'Queries'].mean()}
+
+    def _metric_feature_usage(self, df, shared):
+        """6. Feature Usage"""
+        return {'feature_usage': self.feature_matcher.count(df.loc[df['Role'] == 'human', 'Content'])}
+
+    def _metric_retention(self, df, shared):
+        """7. Retention Rate"""
+        users = shared['users']
+        return {'retention_rates': self._retention_rates(users['First_Date'], users['Last_Date'])}
+
+    def _metric_churn(self, df, shared):
+        """8. Churn Rate"""
+        last_dates = shared['users']['Last_Date']
+        latest_date = last_dates.max()
+        churn_threshold = _days_before(latest_date, 30)
+
+        churned = (last_dates < churn_threshold).sum()
+        return {'churn_rate': churned / len(last_dates) if len(last_dates) > 0 else 0}
+
+    def _metric_rolling_actives(self, df, shared):
+        """9. Rolling 7/28/30-day Active Users (7 = WAU)"""
+        if self.hll_precision:
+            return _sketch_rolling_actives_metrics(shared['day_sketches'])
+        return _rolling_actives_metrics(*shared['user_days'])
+
+    def _metric_stickiness(self, df, shared):
+        """10. DAU/MAU Stickiness per day"""
+        return _stickiness_metrics(*shared['user_days'])
+
+    def _metric_retention_curve(self, df, shared):
+        """11. Rolling Retention Curve"""
+        users = shared['users']
+        return {'retention_curve': _retention_curve(users['First_Date'], users['Last_Date'])}
+
+    def _metric_cohort_retention(self, df, shared):
+        """12. Cohort Retention Matrix"""
+        return {'cohort_retention': _cohort_retention(*shared['user_days'])}
+
+    def _shared_user_days(self, df, shared):
+        """Distinct (user code, day number) pairs sorted by user then day: one pass over events"""
+        codes, _ = pd.factorize(df['User_ID'])
+        days = df['Event_Date'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+        known = codes >= 0  # events without a User ID (code -1) are not a user
+        return _user_day_arrays(codes[known], days[known])
+
+    def _shared_day_sketches(self, df, shared):
+        """HyperLogLog of active users per day number (hll_precision mode)"""
+        return ActiveUserSketches(self.hll_precision).add(_day_numbers(df['Event_Date']), df['User_ID'])
+
+    def _shared_threads(self, df, shared):
+        """Per (user, thread) first/last timestamp, message and query counts: one pass over events"""
+        return _summarize_threads(df)
+
+    def _shared_per_thread(self, df, shared):
+        return _per_thread(shared['threads'])
+
+    def _shared_users(self, df, shared):
+        """Per-user first and last active day number: the ends of each user's run of distinct user-days"""
+        user_codes, days = shared['user_days']
+        ends = np.flatnonzero(np.r_[user_codes[1:] != user_codes[:-1], True][:len(days)])
+        starts = np.r_[0, ends[:-1] + 1][:len(ends)]
+        return pd.DataFrame({'First_Date': days[starts], 'Last_Date': days[ends]})
+
+    def _session_durations(self, df):
+        """Minutes from first to last message of each multi-message thread, ordered by start (then end)"""
+        return _session_minutes(_per_thread(_summarize_threads(df)))
+
+    def _retention_rates(self, first_dates, last_dates, periods=RETENTION_PERIODS):
+        """Share of users who came back on or after day N, for every N in periods
+
+        A user returned on/after day N exactly when their last active day is at
+        least N days after their first, so one sorted array of spans answers
+        every period with a binary search.
+        """
+        spans = _retention_spans(first_dates, last_dates)
+        total = len(spans)
+
+        retention_rates = {}
+        for period in periods:
+            retained = total - int(np.searchsorted(spans, period, side='left'))
+            retention_rates[f'{period}_day'] = retained / total if total > 0 else 0
+        return retention_rates
+
+    def aggregate(self, chunks, aggregates=None):
+        """Fold processed event chunks into compact EventAggregates (or an existing IncrementalState)"""
+        aggregates = aggregates if aggregates is not None else EventAggregates(hll_precision=self.hll_precision)
+        for chunk in chunks:
+            human_messages = chunk[chunk['Role'] == 'human']
+            aggregates.add(chunk, self.feature_matcher.count(human_messages['Content']))
+        return aggregates
+
+    def calculate_parallel(self, df, workers):
+        """Calculate all engagement metrics on a process pool, sharding events by user hash"""
+        return self.calculate_from_aggregates(self.aggregate_parallel([df], workers))
+
+    def aggregate_parallel(self, chunks, workers):
+        """Like aggregate, but summarize each chunk as user-hash shards on a pool of worker processes"""
+        aggregates = EventAggregates(hll_precision=self.hll_precision)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for chunk in chunks:
+                pending.extend(pool.submit(_aggregate_shard, shard, self.hll_precision)
+                               for shard in _shard_by_user(chunk, workers))
+                # Keep at most two chunks in flight so streaming memory stays bounded
+                while len(pending) > 2 * workers:
+                    aggregates.merge(pending.pop(0).result())
+            for future in pending:
+                aggregates.merge(future.result())
+        return aggregates
+
+    def calculate_from_aggregates(self, aggregates):
+        """Calculate all engagement metrics from EventAggregates instead of raw events
+
+        When the aggregates carry HyperLogLog sketches (hll_precision), DAU, MAU
+        and rolling actives are estimated from the merged sketches.
+        """
+        aggregates.compact()
+        user_days = aggregates.user_days
+        codes, _ = pd.factorize(user_days['User_ID'])
+        known = codes >= 0
+        sketches = aggregates.sketches
+        return self._calculate_from_summaries(
+            dau_data=sketches['Date'].counts() if sketches else user_days.groupby('Date').size(),
+            mau_data=sketches['Month'].counts() if sketches else aggregates.user_months.groupby('Month').size(),
+            threads=aggregates.threads,
+            feature_usage=aggregates.feature_usage,
+            first_dates=user_days.groupby('User_ID')['Date'].min(),
+            last_dates=user_days.groupby('User_ID')['Date'].max(),
+            user_days=_user_day_arrays(codes[known], _day_numbers(user_days['Date'])[known]),
+            day_sketches=sketches['Date'] if sketches else None
+        )
+
+    def calculate_from_state(self, state):
+        """Calculate all engagement metrics from a persisted IncrementalState"""
+        users = list(state.active_days)
+        bitmaps = list(state.active_days.values())
+        first_days = [(bits & -bits).bit_length() - 1 for bits in bitmaps]
+        last_days = [bits.bit_length() - 1 for bits in bitmaps]
+
+        # Set bits of each bitmap are that user's active days
+        active = [np.flatnonzero(np.unpackbits(np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'),
+                                                             dtype=np.uint8), bitorder='little'))
+                  for bits in bitmaps]
+        epoch_day = _day_numbers([state.epoch])[0] if bitmaps else 0
+
+        return self._calculate_from_summaries(
+            dau_data=pd.Series(state.dau, dtype='int64').sort_index(),
+            mau_data=pd.Series(state.mau, dtype='int64').sort_index(),
+            threads=state.threads,
+            feature_usage=state.feature_usage,
+            first_dates=pd.Series([state.epoch + timedelta(days=d) for d in first_days], index=users),
+            last_dates=pd.Series([state.epoch + timedelta(days=d) for d in last_days], index=users),
+            user_days=(np.repeat(np.arange(len(active)), [len(days) for days in active]),
+                       np.concatenate(active or [np.zeros(0, dtype=np.int64)]).astype(np.int64) + epoch_day)
+        )
+
+    def _calculate_from_summaries(self, dau_data, mau_data, threads, feature_usage, first_dates, last_dates,
+                                  user_days, per_thread=None, day_sketches=None):
+        """Build the calculate_all_metrics dict from pre-aggregated activity summaries"""
+        metrics = {}
+
+        dau_data, mau_data = _label_days(dau_data), _label_months(mau_data)
+
         # 1. Daily Active Users (DAU)
-        dau_data = df.groupby('Date')['User_ID'].nunique()
         metrics['avg_dau'] = dau_data.mean()
         metrics['dau_data'] = {str(k): v for k, v in dau_data.to_dict().items()}
-        
+
         # 2. Monthly Active Users (MAU)
-        mau_data = df.groupby('Month')['User_ID'].nunique()
         metrics['avg_mau'] = mau_data.mean()
         metrics['mau_data'] = {str(k): v for k, v in mau_data.to_dict().items()}
-        
+
         # 3. Session Duration
-        session_durations = []
-        for thread_id in df['Thread_ID'].unique():
-            thread_data = df[df['Thread_ID'] == thread_id]
-            if len(thread_data) > 1:
-                duration = (thread_data['Event_Date'].max() - 
-                           thread_data['Event_Date'].min()).total_seconds() / 60
-                session_durations.append(duration)
-        
+        per_thread = per_thread if per_thread is not None else _per_thread(threads)
+        session_durations = _session_minutes(per_thread)
+
         metrics['session_durations'] = session_durations
         metrics['avg_session_duration'] = sum(session_durations) / len(session_durations) if session_durations else 0
-        
+
         # 4. Session Frequency (Sessions per User)
-        sessions_per_user = df.groupby('User_ID')['Thread_ID'].nunique()
-        metrics['avg_sessions_per_user'] = sessions_per_user.mean()
-        
+        metrics['avg_sessions_per_user'] = threads.groupby(level='User_ID').size().mean()
+
         # 5. Queries per Session
-        human_messages = df[df['Role'] == 'human']
-        queries_per_session = human_messages.groupby('Thread_ID').size()
-        metrics['avg_queries_per_session'] = queries_per_session.mean()
-        
+        metrics['avg_queries_per_session'] = per_thread.loc[per_thread['Queries'] > 0, 'Queries'].mean()
+
         # 6. Feature Usage
-        feature_usage = {}
-        for feature, keywords in self.feature_keywords.items():
-            count = 0
-            for content in human_messages['Content']:
-                if any(keyword.lower() in content.lower() for keyword in keywords):
-                    count += 1
-            feature_usage[feature] = count
-        metrics['feature_usage'] = feature_usage
-        
+        metrics['feature_usage'] = dict(feature_usage)
+
         # 7. Retention Rate
-        first_dates = df.groupby('User_ID')['Date'].min()
-        all_dates = df.groupby('User_ID')['Date'].apply(set)
-        
-        retention_rates = {}
-        for period in [1, 7, 30]:
-            retained = 0
-            total = len(first_dates)
-            
-            for user_id, first_date in first_dates.items():
-                target_date = first_date + timedelta(days=period)
-                if any(date >= target_date for date in all_dates[user_id]):
-                    retained += 1
-            
-            retention_rates[f'{period}_day'] = retained / total if total > 0 else 0
-        
-        metrics['retention_rates'] = retention_rates
-        
+        metrics['retention_rates'] = self._retention_rates(first_dates, last_dates)
+
         # 8. Churn Rate
-        last_dates = df.groupby('User_ID')['Date'].max()
-        latest_date = df['Date'].max()
-        churn_threshold = latest_date - timedelta(days=30)
-        
+        latest_date = last_dates.max()
+        churn_threshold = _days_before(latest_date, 30)
+
         churned = (last_dates < churn_threshold).sum()
         metrics['churn_rate'] = churned / len(last_dates) if len(last_dates) > 0 else 0
-        
+
+        # 9-11. Rolling actives, stickiness and rolling retention curve
+        metrics.update(_sketch_rolling_actives_metrics(day_sketches) if day_sketches is not None
+                       else _rolling_actives_metrics(*user_days))
+        metrics.update(_stickiness_metrics(*user_days))
+        metrics['retention_curve'] = _retention_curve(first_dates, last_dates)
+
+        # 12. Cohort Retention Matrix
+        metrics['cohort_retention'] = _cohort_retention(*user_days)
+
         return metrics
+
+
+class EventAggregates:
+    """Compact, mergeable summary of processed events used for streaming metrics
+
+    Holds only distinct (user, day) and (user, month) pairs, per (user, thread)
+    first/last timestamps with message and query counts, and feature usage
+    totals, so memory grows with users x active days and threads rather than
+    with raw message rows. With hll_precision it also keeps per-day and
+    per-month HyperLogLog sketches, merged across chunks and workers.
+    """
+
+    def __init__(self, compact_every=16, hll_precision=None):
+        self.compact_every = compact_every
+        self.sketches = ({'Date': ActiveUserSketches(hll_precision), 'Month': ActiveUserSketches(hll_precision)}
+                         if hll_precision else None)
+        self.user_days = None
+        self.user_months = None
+        self.threads = None
+        self.feature_usage = {}
+        self.total_events = 0
+        self._pending = []
+
+    @property
+    def total_users(self):
+        self.compact()
+        return self.user_days['User_ID'].nunique()
+
+    def add(self, df, feature_usage):
+        """Summarize one processed chunk and queue it for merging"""
+        # Months come from the (much smaller) distinct user-days: Period de-duplication is slow per row
+        user_days = df[['User_ID', 'Date', 'Month']].dropna(subset=['User_ID']).drop_duplicates(['User_ID', 'Date'])
+        user_months = user_days[['User_ID', 'Month']].drop_duplicates()
+        self._pending.append((user_days[['User_ID', 'Date']], user_months, _summarize_threads(df)))
+        if self.sketches is not None:
+            self.sketches['Date'].add(_day_numbers(user_days['Date']), user_days['User_ID'])
+            self.sketches['Month'].add(user_months['Month'], user_months['User_ID'])
+
+        for feature, count in feature_usage.items():
+            self.feature_usage[feature] = self.feature_usage.get(feature, 0) + count
+        self.total_events += len(df)
+
+        if len(self._pending) >= self.compact_every:
+            self.compact()
+
+    def merge(self, other):
+        """Fold another EventAggregates into this one"""
+        other.compact()
+        self._pending.append((other.user_days, other.user_months, other.threads))
+        if self.sketches is not None:
+            self.sketches['Date'].merge(other.sketches['Date'])
+            self.sketches['Month'].merge(other.sketches['Month'])
+        for feature, count in other.feature_usage.items():
+            self.feature_usage[feature] = self.feature_usage.get(feature, 0) + count
+        self.total_events += other.total_events
+
+        if len(self._pending) >= self.compact_every:
+            self.compact()
+        return self
+
+    def compact(self):
+        """Merge queued chunk summaries into the running aggregates"""
+        if not self._pending:
+            return
+
+        user_days, user_months, threads = zip(*self._pending)
+        self._pending = []
+
+        self.user_days = _concat(self.user_days, user_days).drop_duplicates(ignore_index=True)
+        self.user_months = _concat(self.user_months, user_months).drop_duplicates(ignore_index=True)
+        self.threads = _merge_threads(_concat(self.threads, threads))
+
+
+class IncrementalState:
+    """Persisted engagement state for daily runs over an append-only event log
+
+    Keeps one active-day bitmap per user (bit i set = active on epoch + i
+    days), running per-day DAU and per-month MAU counters, per (user, thread)
+    session summaries and feature usage totals. Each run folds in only the
+    new events; first/last active dates come from the lowest/highest bits.
+    """
+
+    def __init__(self):
+        self.epoch = None
+        self.active_days = {}
+        self.dau = {}
+        self.mau = {}
+        self.threads = None
+        self.feature_usage = {}
+        self.total_events = 0
+
+    @classmethod
+    def load(cls, path):
+        """Load saved state, or start empty if path does not exist yet"""
+        state = cls()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                state.__dict__.update(pickle.load(f))
+        return state
+
+    def save(self, path):
+        """Persist the state for the next run"""
+        with open(path, 'wb') as f:
+            pickle.dump(self.__dict__, f)
+
+    @property
+    def total_users(self):
+        return len(self.active_days)
+
+    def add(self, df, feature_usage):
+        """Fold one processed chunk of new events into the state"""
+        if df.empty:
+            return
+
+        pairs = df[['User_ID', 'Date', 'Month']].dropna(subset=['User_ID']).drop_duplicates(['User_ID', 'Date'])
+        first_day = pairs['Date'].min()
+        if pairs.empty:
+            pass  # only events without a User ID: no active days to record
+        elif self.epoch is None:
+            self.epoch = first_day
+        elif first_day < self.epoch:
+            # Late events older than day 0: re-base every bitmap
+            shift = (self.epoch - first_day).days
+            self.active_days = {user: bits << shift for user, bits in self.active_days.items()}
+            self.epoch = first_day
+
+        month_masks = {}
+        for user, date, month in zip(pairs['User_ID'], pairs['Date'], pairs['Month']):
+            bits = self.active_days.get(user, 0)
+            bit = 1 << (date - self.epoch).days
+            if bits & bit:
+                continue
+
+            if month not in month_masks:
+                month_masks[month] = self._month_mask(month)
+            if not bits & month_masks[month]:
+                self.mau[month] = self.mau.get(month, 0) + 1
+            self.dau[date] = self.dau.get(date, 0) + 1
+            self.active_days[user] = bits | bit
+
+        self._add_threads(_summarize_threads(df))
+        for feature, count in feature_usage.items():
+            self.feature_usage[feature] = self.feature_usage.get(feature, 0) + count
+        self.total_events += len(df)
+
+    def _month_mask(self, month):
+        """Bitmap with the bits of every day of month set"""
+        start = max((month.start_time.date() - self.epoch).days, 0)
+        end = (month.end_time.date() - self.epoch).days + 1
+        return ((1 << (end - start)) - 1) << start if end > start else 0
+
+    def _add_threads(self, threads):
+        """Merge new thread summaries, touching only threads seen in this batch"""
+        if self.threads is None:
+            self.threads = threads
+            return
+
+        seen = threads.index.isin(self.threads.index)
+        if seen.any():
+            index = threads.index[seen]
+            self.threads.loc[index] = _merge_threads(pd.concat([self.threads.loc[index], threads[seen]]))
+        self.threads = pd.concat([self.threads, threads[~seen]])
+
+
+def resolve_metric_names(names=None):
+    """Validated metric names in registry order (all metrics when names is None)"""
+    if names is None:
+        return list(METRICS)
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)} (choose from {', '.join(METRICS)})")
+    return [name for name in METRICS if name in names]
+
+
+def select_metrics(metrics, names=None):
+    """Only the keys of a metrics dict that belong to the named metrics"""
+    keys = [key for name in resolve_metric_names(names) for key in METRICS[name]['keys']]
+    return {key: metrics[key] for key in keys if key in metrics}
+
+
+class _SharedIntermediates:
+    """Per-run cache of intermediates shared between metrics, computed on first use"""
+
+    def __init__(self, calculator, df):
+        self.calculator = calculator
+        self.df = df
+        self.values = {}
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            self.values[name] = getattr(self.calculator, f'_shared_{name}')(self.df, self)
+        return self.values[name]
+
+    def release(self, keep):
+        self.values = {name: value for name, value in self.values.items() if name in keep}
+
+
+def _aggregate_shard(shard, hll_precision=None):
+    """Worker entry point: EventAggregates (with sketches at hll_precision) of one shard of processed events"""
+    if 'Date' not in shard:
+        shard = shard.assign(Date=shard['Event_Date'].dt.date)
+    return MetricsCalculator(hll_precision).aggregate([shard])
+
+
+def _shard_by_user(df, shards):
+    """Split events into shards by a stable hash of User_ID (every user lands in exactly one shard)"""
+    shard_of = pd.util.hash_pandas_object(df['User_ID'], index=False).to_numpy() % shards
+    df = df[SHARD_COLUMNS + (['Date'] if is_compact(df) else [])]
+    return [df[shard_of == i] for i in range(shards)]
+
+
+def _retention_spans(first_dates, last_dates):
+    """Sorted days from each user's first to last active day"""
+    if pd.api.types.is_integer_dtype(first_dates):
+        return np.sort((last_dates - first_dates).to_numpy())
+    return np.sort((pd.to_datetime(last_dates) - pd.to_datetime(first_dates)).dt.days.to_numpy())
+
+
+def _retention_curve(first_dates, last_dates):
+    """Rolling retention for every day N: share of users active on or after day N (index = N)"""
+    spans = _retention_spans(first_dates, last_dates)
+    if len(spans) == 0:
+        return []
+    retained = len(spans) - np.searchsorted(spans, np.arange(spans[-1] + 1), side='left')
+    return (retained / len(spans)).tolist()
+
+
+def _day_numbers(dates):
+    """int64 days since 1970-01-01 for dates, timestamps or compact day numbers"""
+    if pd.api.types.is_integer_dtype(np.asarray(dates).dtype):
+        return np.asarray(dates, dtype=np.int64)
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+def _user_day_arrays(user_codes, days):
+    """Distinct (user code, day) pairs as two arrays sorted by user, then day"""
+    if len(days) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Pack each pair into one int64 so a flat unique sorts and de-duplicates them
+    first, span = days.min(), days.max() - days.min() + 1
+    keys = np.unique(np.asarray(user_codes, dtype=np.int64) * span + (days - first))
+    return keys // span, keys % span + first
+
+
+def _rolling_active_counts(user_codes, days, window):
+    """Distinct users active in the trailing `window` days ending on each day from the first to the last day
+
+    Each user-day covers the window days starting on it. Starting coverage at
+    the end of the same user's previous coverage instead keeps a user from
+    being counted twice, so one difference array and a cumulative sum give
+    every day's count in O(user-days + days).
+    """
+    first, span = days.min(), days.max() - days.min() + 1
+    offsets = days - first
+    same_user = np.r_[False, user_codes[1:] == user_codes[:-1]]
+    previous = np.where(same_user, np.r_[0, offsets[:-1]], -window)
+    starts = np.maximum(offsets, previous + window)
+
+    size = span + window
+    changes = np.bincount(starts, minlength=size) - np.bincount(offsets + window, minlength=size)
+    return np.cumsum(changes)[:span]
+
+
+def _day_labels(first_day, count):
+    """ISO date strings for count consecutive day numbers starting at first_day"""
+    return [str(day) for day in days_to_dates(np.arange(first_day, first_day + count))]
+
+
+def _rolling_actives_metrics(user_codes, days):
+    """Per-day rolling active users for each of ROLLING_WINDOWS, and the average WAU"""
+    if len(days) == 0:
+        return {'avg_wau': 0, 'rolling_actives': {f'{window}_day': {} for window in ROLLING_WINDOWS}}
+
+    counts = {window: _rolling_active_counts(user_codes, days, window) for window in {7, *ROLLING_WINDOWS}}
+    labels = _day_labels(days.min(), len(counts[7]))
+    return {'avg_wau': counts[7].mean(),
+            'rolling_actives': {f'{window}_day': dict(zip(labels, counts[window].tolist()))
+                                for window in ROLLING_WINDOWS}}
+
+
+def _sketch_rolling_actives_metrics(day_sketches):
+    """Like _rolling_actives_metrics, estimated by unions of daily HyperLogLog sketches"""
+    if not day_sketches.periods:
+        return {'avg_wau': 0, 'rolling_actives': {f'{window}_day': {} for window in ROLLING_WINDOWS}}
+
+    counts = {window: day_sketches.rolling(window) for window in {7, *ROLLING_WINDOWS}}
+    return {'avg_wau': counts[7].mean(),
+            'rolling_actives': {f'{window}_day': dict(zip(map(str, counts[window].index), counts[window].tolist()))
+                                for window in ROLLING_WINDOWS}}
+
+
+def _stickiness_metrics(user_codes, days):
+    """Per-day DAU divided by trailing STICKINESS_WINDOW-day actives, and its average"""
+    if len(days) == 0:
+        return {'avg_stickiness': 0, 'stickiness_data': {}}
+
+    monthly = _rolling_active_counts(user_codes, days, STICKINESS_WINDOW)
+    daily = np.bincount(days - days.min(), minlength=len(monthly))
+    stickiness = np.divide(daily, monthly, out=np.zeros(len(monthly)), where=monthly > 0)
+    return {'avg_stickiness': stickiness.mean(),
+            'stickiness_data': dict(zip(_day_labels(days.min(), len(stickiness)), stickiness.tolist()))}
+
+
+def _users_per_period(user_codes, days, period):
+    """Distinct users per day or month number, from user-days sorted by user then day"""
+    periods = _period_numbers(days, period) if len(days) else days
+    new = np.r_[True, (user_codes[1:] != user_codes[:-1]) | (periods[1:] != periods[:-1])][:len(days)]
+    values, counts = np.unique(periods[new], return_counts=True)
+    return pd.Series(counts, index=values)
+
+
+def _period_numbers(days, period):
+    """Calendar day, Monday-starting week or month number of each day number"""
+    if period == 'day':
+        return days
+    if period == 'week':
+        return (days + 3) // 7  # 1970-01-01 was a Thursday
+    if period == 'month':
+        # Convert each calendar day once rather than every event day
+        first = days.min()
+        months = np.arange(first, days.max() + 1).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        return months[days - first]
+    raise ValueError(f"Unknown cohort period: {period} (choose from day, week, month)")
+
+
+def _period_labels(periods, period):
+    """ISO start date (or YYYY-MM for months) of each period number"""
+    if period == 'month':
+        return [str(month) for month in months_to_periods(periods)]
+    starts = periods * 7 - 3 if period == 'week' else periods
+    return [str(day) for day in days_to_dates(starts)]
+
+
+def _cohort_retention(user_codes, days, period=COHORT_PERIOD):
+    """Retention matrix: share of each signup cohort active N periods after its first period
+
+    Works on the sorted distinct (user, day) pairs, so a user's first pair is
+    their signup day. Distinct (user, age) pairs are counted with a single
+    bincount over cohort x age cells, in O(user-days) whatever the number of
+    cohorts. Row i of rates stops at the last period the data covers.
+    """
+    if len(days) == 0:
+        return {'period': period, 'cohorts': [], 'sizes': [], 'rates': []}
+
+    periods = _period_numbers(days, period)
+    new_user = np.r_[True, user_codes[1:] != user_codes[:-1]]
+    signup = periods[new_user][np.cumsum(new_user) - 1]
+    ages = periods - signup
+
+    # Ages never decrease within a user, so a change of user or age marks a new distinct pair
+    distinct = new_user | np.r_[True, ages[1:] != ages[:-1]]
+    first, last = signup.min(), periods.max()
+    cohorts = width = last - first + 1
+    active = np.bincount((signup[distinct] - first) * width + ages[distinct],
+                         minlength=cohorts * width).reshape(cohorts, width)
+    sizes = active[:, 0]
+
+    rates = np.divide(active, sizes[:, np.newaxis], out=np.zeros(active.shape), where=sizes[:, np.newaxis] > 0)
+    present = np.flatnonzero(sizes)
+    return {'period': period,
+            'cohorts': _period_labels(first + present, period),
+            'sizes': sizes[present].tolist(),
+            'rates': [rates[i, :width - i].tolist() for i in present]}
+
+
+def _label_days(series):
+    """Index compact day numbers by datetime.date (other indexes pass through)"""
+    if pd.api.types.is_integer_dtype(series.index):
+        series = series.set_axis(days_to_dates(series.index))
+    return series
+
+
+def _label_months(series):
+    """Index compact month numbers by monthly Period (other indexes pass through)"""
+    if pd.api.types.is_integer_dtype(series.index):
+        series = series.set_axis(months_to_periods(series.index))
+    return series
+
+
+def _days_before(day, days):
+    """The day `days` days before `day`, for datetime.date or compact day numbers"""
+    return day - days if isinstance(day, (int, np.integer)) else day - timedelta(days=days)
+
+
+def _summarize_threads(df, segments=None):
+    """Per (user, thread) first/last timestamp, message count and human query count (per segment if given)"""
+    events = pd.DataFrame({'User_ID': df['User_ID'], 'Thread_ID': df['Thread_ID'], 'Event_Date': df['Event_Date'],
+                           'Queries': (df['Role'] == 'human').astype('int64')})
+    keys = ['User_ID', 'Thread_ID']
+    if segments is not None:
+        events.insert(0, 'Segment', segments)
+        keys = ['Segment'] + keys
+    return (events.groupby(keys, sort=False)
+            .agg(First=('Event_Date', 'min'), Last=('Event_Date', 'max'),
+                 Messages=('Event_Date', 'size'), Queries=('Queries', 'sum')))
+
+
+def _per_thread(threads, segmented=False):
+    """Per-thread totals of (user, thread) summaries, ordered by first event (then last), per segment if segmented"""
+    keys = ['Segment', 'Thread_ID'] if segmented else ['Thread_ID']
+    return threads.groupby(level=keys, sort=False).agg(
+        First=('First', 'min'), Last=('Last', 'max'),
+        Messages=('Messages', 'sum'), Queries=('Queries', 'sum')
+    ).sort_values(keys[:-1] + ['First', 'Last'])
+
+
+def _session_minutes(per_thread):
+    """Minutes from first to last message of each multi-message thread"""
+    multi = per_thread[per_thread['Messages'] > 1]
+    return ((multi['Last'] - multi['First']).dt.total_seconds() / 60).tolist()
+
+
+def _merge_threads(threads):
+    """Combine thread summaries that share a (user, thread) key"""
+    return threads.groupby(level=['User_ID', 'Thread_ID'], sort=False).agg(
+        {'First': 'min', 'Last': 'max', 'Messages': 'sum', 'Queries': 'sum'}
+    )
+
+
+def _concat(current, frames):
+    """Concatenate queued frames onto the current one (which may still be None)"""
+    frames = [f for f in (current, *frames) if f is not None]
+    return pd.concat(frames, ignore_index=isinstance(frames[0].index, pd.RangeIndex))
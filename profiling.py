@@ -0,0 +1,102 @@
+"""
+Per-Stage Timing and Memory Instrumentation
+"""
+
+import cProfile
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def peak_rss_mb():
+    """Peak resident set size in MB since the last reset_peak_rss() (since process start if never reset)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 1024  # bytes on macOS, KB elsewhere
+
+
+def reset_peak_rss():
+    """Restart the peak_rss_mb() high-water mark from the current RSS (Linux); False where unsupported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageProfiler:
+    """Records wall time, CPU time, row count and peak RSS of named pipeline stages
+
+    Stages may nest (e.g. each metric inside 'metrics'). Peak RSS is per stage:
+    the high-water mark is reset when a stage starts, and the peak reached so
+    far is first carried into every enclosing stage. Where the mark cannot be
+    reset (non-Linux) it is the process peak so far, and the trace says so
+    with peak_rss_scope 'process'. With cprofile=True
+    every top-level stage also runs under cProfile, and dump_slowest() writes
+    the stats of the slowest one as a .prof file (pstats format, readable by
+    snakeviz, flameprof or gprof2dot). A disabled profiler records nothing.
+    """
+
+    def __init__(self, enabled=True, cprofile=False):
+        self.enabled = enabled
+        self.cprofile = enabled and cprofile
+        self.stages = {}
+        self._profiles = {}
+        self._depth = 0
+        self._open_peaks = []  # peak RSS so far of each running stage, outermost first
+        self._process_peak = 0
+        self._stage_scoped = False
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Measure the enclosed block; the yielded record accepts a late 'rows' count"""
+        record = {'rows': rows}
+        if not self.enabled:
+            yield record
+            return
+
+        profile = cProfile.Profile() if self.cprofile and self._depth == 0 else None
+        self._depth += 1
+        peak = peak_rss_mb()
+        self._process_peak = max(self._process_peak, peak)
+        self._open_peaks = [max(open_peak, peak) for open_peak in self._open_peaks] + [0]
+        self._stage_scoped = reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiles[name] = profile
+            self._depth -= 1
+            peak = max(self._open_peaks.pop(), peak_rss_mb())
+            self._process_peak = max(self._process_peak, peak)
+            record.update(depth=self._depth, wall_s=time.perf_counter() - wall,
+                          cpu_s=time.process_time() - cpu, peak_rss_mb=peak)
+            self.stages[name] = record
+
+    def write(self, path):
+        """Write the stage records as a JSON trace"""
+        with open(path, 'w') as f:
+            json.dump({'stages': self.stages, 'peak_rss_mb': max(self._process_peak, peak_rss_mb()),
+                       'peak_rss_scope': 'stage' if self._stage_scoped else 'process'}, f, indent=2)
+
+    def dump_slowest(self, path_prefix):
+        """Write cProfile stats of the slowest top-level stage to <path_prefix>_<stage>.prof; returns the path"""
+        if not self._profiles:
+            return None
+        slowest = max(self._profiles, key=lambda name: self.stages[name]['wall_s'])
+        path = f"{path_prefix}_{slowest}.prof"
+        self._profiles[slowest].dump_stats(path)
+        return path
@@ -9,8 +9,9 @@ import os
 import json
 import pandas as pd
 from data_processor import DataProcessor, DataGenerator
-from metrics_calculator import MetricsCalculator
+from metrics_calculator import MetricsCalculator, IncrementalState, METRICS, resolve_metric_names, select_metrics
 from html_generator import HTMLGenerator
+from profiling import StageProfiler
 
 
 def main():
@@ -21,75 +22,267 @@ def main():
     parser.add_argument('--scenario', default='standard',
                         choices=['standard', 'high_engagement', 'low_retention', 'rapid_growth'],
                         help='Data generation scenario')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible generated data')
     parser.add_argument('--output', default='output', help='Output directory')
+    parser.add_argument('--save-data', action='store_true',
+                        help='Also write generated data to generated_data.csv (on a background thread)')
+    parser.add_argument('--chunksize', type=int,
+                        help='Stream the input in chunks of this many rows (bounded memory)')
+    parser.add_argument('--cache', help='Directory for the processed-events Parquet cache (needs pyarrow)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Compute metrics on this many processes, sharding events by user')
+    parser.add_argument('--hll-precision', type=int,
+                        help='HyperLogLog sketches of 2^P registers (4-18) for approximate DAU/MAU and rolling actives')
+    parser.add_argument('--compact', action='store_true',
+                        help='Dictionary-encode IDs and use day numbers in the processed events (less memory)')
+    parser.add_argument('--metrics',
+                        help=f"Comma-separated subset of metrics to compute ({', '.join(METRICS)}); default all")
+    parser.add_argument('--segment-by',
+                        help='Also compute all metrics per value of these columns (e.g. Feature,Hour), in metrics.json')
+    parser.add_argument('--user-attributes',
+                        help="CSV of per-user attributes ('User ID' column) whose columns --segment-by may name")
+    parser.add_argument('--profile', action='store_true',
+                        help='Write per-stage and per-metric wall/CPU time, rows and peak memory to profile.json')
+    parser.add_argument('--profile-dump', action='store_true',
+                        help='Like --profile, plus a cProfile dump (.prof) of the slowest stage')
+    parser.add_argument('--report-points', type=int,
+                        help='Lightweight report: chart the whole DAU history downsampled to this many points')
+    parser.add_argument('--report-data', action='store_true',
+                        help='Write report chart data to a gzipped sidecar fetched by the page (serve over HTTP)')
+    parser.add_argument('--offline-report', action='store_true',
+                        help='Draw report charts as inline SVG: no scripts or network access needed to view it')
+    parser.add_argument('--start', help='Only analyze events on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--end', help='Only analyze events on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--state',
+                        help='Incremental mode: fold the input (new events only) into the state file at this path')
 
     args = parser.parse_args()
+    if args.compact and args.state:
+        parser.error('--compact cannot be combined with --state')
+    if args.hll_precision is not None and not 4 <= args.hll_precision <= 18:
+        parser.error('--hll-precision must be between 4 and 18')
+    if args.hll_precision and args.state:
+        parser.error('--hll-precision cannot be combined with --state')
+    if args.report_points is not None and args.report_points < 3:
+        parser.error('--report-points must be at least 3 (the first and last day plus one bucket)')
+    if args.offline_report and args.report_data:
+        parser.error('--offline-report cannot be combined with --report-data')
+    if args.segment_by and (args.chunksize or args.state or args.workers > 1):
+        parser.error('--segment-by needs in-memory mode (no --chunksize, --state or --workers)')
+    if args.user_attributes and (args.compact or not args.segment_by):
+        parser.error('--user-attributes needs --segment-by and cannot be combined with --compact')
+    for name in ('start', 'end'):
+        try:
+            pd.Timestamp(getattr(args, name) or 0)
+        except ValueError:
+            parser.error(f"--{name}: not a date: {getattr(args, name)}")
+    if args.start and args.end and pd.Timestamp(args.start) > pd.Timestamp(args.end):
+        parser.error('--start must not be after --end')
+    try:
+        metric_names = resolve_metric_names(args.metrics.split(',') if args.metrics else None)
+    except ValueError as e:
+        parser.error(str(e))
+    user_attributes = _load_user_attributes(args.user_attributes) if args.user_attributes else None
     os.makedirs(args.output, exist_ok=True)
 
     print("🚀 Starting User Engagement Analytics...")
+    profiler = StageProfiler(enabled=args.profile or args.profile_dump, cprofile=args.profile_dump)
 
-    # Generate or load data
+    processor = DataProcessor(cache_dir=args.cache, compact=args.compact)
+    calculator = MetricsCalculator(hll_precision=args.hll_precision)
+
+    # Load data, or generate processed events in memory (no CSV write and re-parse)
     if args.input:
         print(f"📂 Loading data from {args.input}...")
-        input_file = args.input
+        read_stage = 'process'
+        load_frame = lambda columns=None: processor.process_csv(args.input, columns=columns,
+                                                                 start=args.start, end=args.end)
+        load_chunks = lambda: processor.iter_csv(args.input, chunksize=args.chunksize,
+                                                 start=args.start, end=args.end)
+        finish_writes = lambda: None
     else:
         print(f"🎲 Generating {args.scenario} scenario ({args.users} users, {args.days} days)...")
         generator = DataGenerator()
-        df_raw = generator.generate(users=args.users, days=args.days, scenario=args.scenario)
+        csv_path = f"{args.output}/generated_data.csv" if args.save_data else None
+        if csv_path:
+            print(f"💾 Writing the generated data to {csv_path} in the background")
+        generate = lambda chunksize, columns=None: processor.iter_generated(
+            generator, chunksize=chunksize, columns=columns, csv_path=csv_path, start=args.start, end=args.end,
+            users=args.users, days=args.days, scenario=args.scenario, seed=args.seed)
+        read_stage = 'generate'
+        load_chunks = lambda: generate(args.chunksize)
+
+        # The single in-memory frame is taken now, but its generator is only run to the end
+        # after the metrics, so the background CSV write overlaps them and its errors surface
+        unfinished = []
+
+        def load_frame(columns=None):
+            unfinished.append(generate(None, columns))
+            return next(unfinished[-1])
 
-        input_file = f"{args.output}/generated_data.csv"
-        df_raw.to_csv(input_file, index=False)
-        print(f"✅ Created {len(df_raw)} interactions from {df_raw['User ID'].nunique()} users")
+        finish_writes = lambda: [frame for frames in unfinished for frame in frames]
 
-    # Process data
-    print("📊 Processing data...")
-    processor = DataProcessor()
-    df = processor.process_csv(input_file)
+    if args.state:
+        # Incremental: fold only the new events into the persisted state
+        print(f"📊 Folding new events into {args.state}...")
+        with profiler.stage('aggregate') as stage:
+            state = IncrementalState.load(args.state)
+            events_before = state.total_events
+            if args.chunksize:
+                calculator.aggregate(load_chunks(), state)
+            else:
+                calculator.aggregate([load_frame()], state)
+            if not state.total_events:
+                raise _no_events(args.start, args.end)
+            state.save(args.state)
+            stage['rows'] = state.total_events - events_before
+
+        print("📈 Calculating metrics...")
+        with profiler.stage('metrics'):
+            metrics = calculator.calculate_from_state(state)
+        total_users, total_interactions = state.total_users, state.total_events
+    elif args.chunksize:
+        # Stream: keep only compact aggregates, never the full event table
+        print(f"📊 Processing data in chunks of {args.chunksize:,} rows...")
+        with profiler.stage('aggregate') as stage:
+            chunks = load_chunks()
+            if args.workers > 1:
+                aggregates = calculator.aggregate_parallel(chunks, args.workers)
+            else:
+                aggregates = calculator.aggregate(chunks)
+            stage['rows'] = aggregates.total_events
+        if not aggregates.total_events:
+            raise _no_events(args.start, args.end)
+
+        print("📈 Calculating metrics...")
+        with profiler.stage('metrics', rows=aggregates.total_events):
+            metrics = calculator.calculate_from_aggregates(aggregates)
+        total_users, total_interactions = aggregates.total_users, aggregates.total_events
+    else:
+        # Process data
+        print("📊 Processing data...")
+        # A metric subset only needs its own columns (plus User_ID for the totals)
+        columns = None
+        if len(metric_names) < len(METRICS) and args.workers == 1 and not args.segment_by:
+            columns = ['User_ID'] + calculator.required_columns(metric_names)
+        with profiler.stage(read_stage) as stage:
+            df = load_frame(columns)
+            stage['rows'] = len(df)
+        if not len(df):
+            raise _no_events(args.start, args.end)
 
-    # Calculate metrics
-    print("📈 Calculating metrics...")
-    calculator = MetricsCalculator()
-    metrics = calculator.calculate_all_metrics(df)
+        # Calculate metrics
+        print("📈 Calculating metrics...")
+        with profiler.stage('metrics', rows=len(df)):
+            if args.workers > 1:
+                metrics = calculator.calculate_parallel(df, args.workers)
+            else:
+                metrics = calculator.calculate_metrics(
+                    df, metric_names, timer=lambda name: profiler.stage(f'metric:{name}', rows=len(df)))
+        total_users, total_interactions = df['User_ID'].nunique(), len(df)
+
+        if args.segment_by:
+            print(f"🧩 Segmenting by {args.segment_by}...")
+            with profiler.stage('segments', rows=len(df)):
+                try:
+                    segments = calculator.calculate_segmented(df, args.segment_by.split(','), user_attributes)
+                except ValueError as e:
+                    raise SystemExit(f"❌ {e}")
+
+    finish_writes()
+    if not args.input:
+        print(f"✅ Created {total_interactions} interactions from {total_users} users")
 
     # Generate reports
     print("📋 Generating reports...")
+    metrics = select_metrics(metrics, metric_names)
+    if args.segment_by:
+        metrics['segments'] = {column: {value: select_metrics(segment, metric_names)
+                                        for value, segment in values.items()}
+                               for column, values in segments.items()}
 
-    # JSON metrics
-    with open(f"{args.output}/metrics.json", 'w') as f:
-        json.dump(metrics, f, indent=2, default=str)
+    with profiler.stage('reports'):
+        html = write_reports(metrics, args.output, total_users, total_interactions, metric_names,
+                             max_points=args.report_points, data_file=args.report_data, offline=args.offline_report)
+        if not html:
+            print("ℹ️  Skipping the HTML report: it needs all metrics")
 
-    # CSV summary
-    summary_data = {
-        'Metric': [
-            'Total Users', 'Total Interactions', 'Avg DAU', 'Avg Session Duration (min)',
-            '1-day Retention (%)', '7-day Retention (%)', 'Churn Rate (%)'
-        ],
-        'Value': [
-            df['User_ID'].nunique(), len(df), round(metrics['avg_dau'], 1),
-            round(metrics['avg_session_duration'], 1),
-            round(metrics['retention_rates']['1_day'] * 100, 1),
-            round(metrics['retention_rates']['7_day'] * 100, 1),
-            round(metrics['churn_rate'] * 100, 1)
-        ]
-    }
-    pd.DataFrame(summary_data).to_csv(f"{args.output}/summary.csv", index=False)
-
-    # HTML report
-    html_generator = HTMLGenerator()
-    html_generator.generate_report(metrics, f"{args.output}/report.html")
+    # Profile trace
+    if profiler.enabled:
+        profiler.write(f"{args.output}/profile.json")
+        print(f"⏱️  Stage timings: {args.output}/profile.json")
+        dump = profiler.dump_slowest(f"{args.output}/profile")
+        if dump:
+            print(f"🔥 cProfile of the slowest stage: {dump}")
 
     # Results summary
     print(f"\n🎉 Analysis Complete!")
-    print(f"📊 Users: {df['User_ID'].nunique()} | Interactions: {len(df)}")
-    print(f"📈 DAU: {metrics['avg_dau']:.1f} | Session: {metrics['avg_session_duration']:.1f}min")
-    print(
-        f"🔄 Retention: {metrics['retention_rates']['1_day']:.1%} (1d) | {metrics['retention_rates']['7_day']:.1%} (7d)")
-
-    top_features = sorted(metrics['feature_usage'].items(), key=lambda x: x[1], reverse=True)[:3]
-    print(f"🎯 Top Features: {', '.join([f'{k}({v})' for k, v in top_features])}")
+    print(f"📊 Users: {total_users} | Interactions: {total_interactions}")
+    activity = []
+    if 'avg_dau' in metrics:
+        activity.append(f"DAU: {metrics['avg_dau']:.1f}")
+    if 'avg_session_duration' in metrics:
+        activity.append(f"Session: {metrics['avg_session_duration']:.1f}min")
+    if activity:
+        print(f"📈 {' | '.join(activity)}")
+    if 'retention_rates' in metrics:
+        print(f"🔄 Retention: {metrics['retention_rates']['1_day']:.1%} (1d) | "
+              f"{metrics['retention_rates']['7_day']:.1%} (7d)")
+    if 'feature_usage' in metrics:
+        top_features = sorted(metrics['feature_usage'].items(), key=lambda x: x[1], reverse=True)[:3]
+        print(f"🎯 Top Features: {', '.join([f'{k}({v})' for k, v in top_features])}")
     print(f"📁 Reports: {args.output}/")
 
 
+def _load_user_attributes(path):
+    """Per-user attributes indexed by User ID, checked before any processing"""
+    attributes = pd.read_csv(path)
+    if 'User ID' not in attributes:
+        raise SystemExit(f"❌ {path}: needs a 'User ID' column (found: {', '.join(attributes.columns)})")
+    repeated = attributes.loc[attributes['User ID'].duplicated(), 'User ID'].unique()
+    if len(repeated):
+        raise SystemExit(f"❌ {path}: each User ID must appear once, repeated: "
+                         f"{', '.join(map(str, repeated[:5]))}{'...' if len(repeated) > 5 else ''}")
+    return attributes.set_index('User ID')
+
+
+def _no_events(start=None, end=None):
+    """Exit error for an input (or --start/--end window) without any events"""
+    if start or end:
+        return SystemExit(f"❌ No events in range {start or '...'} to {end or '...'}")
+    return SystemExit("❌ No events to analyze")
+
+
+def write_reports(metrics, output_dir, total_users, total_interactions, metric_names=None, **html_options):
+    """Write metrics.json, summary.csv and (for all metrics) report.html; returns whether the HTML was written"""
+    # JSON metrics
+    with open(f"{output_dir}/metrics.json", 'w') as f:
+        json.dump(metrics, f, indent=2, default=str)
+
+    # CSV summary (rows for the metrics that were computed)
+    summary_rows = [('Total Users', total_users), ('Total Interactions', total_interactions)]
+    if 'avg_dau' in metrics:
+        summary_rows.append(('Avg DAU', round(metrics['avg_dau'], 1)))
+    if 'avg_wau' in metrics:
+        summary_rows.append(('Avg WAU', round(metrics['avg_wau'], 1)))
+    if 'avg_stickiness' in metrics:
+        summary_rows.append(('DAU/MAU Stickiness (%)', round(metrics['avg_stickiness'] * 100, 1)))
+    if 'avg_session_duration' in metrics:
+        summary_rows.append(('Avg Session Duration (min)', round(metrics['avg_session_duration'], 1)))
+    if 'retention_rates' in metrics:
+        summary_rows += [('1-day Retention (%)', round(metrics['retention_rates']['1_day'] * 100, 1)),
+                         ('7-day Retention (%)', round(metrics['retention_rates']['7_day'] * 100, 1))]
+    if 'churn_rate' in metrics:
+        summary_rows.append(('Churn Rate (%)', round(metrics['churn_rate'] * 100, 1)))
+    pd.DataFrame(summary_rows, columns=['Metric', 'Value']).to_csv(f"{output_dir}/summary.csv", index=False)
+
+    # HTML report (the dashboard shows every metric)
+    if metric_names is not None and len(metric_names) < len(METRICS):
+        return False
+    HTMLGenerator().generate_report(metrics, f"{output_dir}/report.html", **html_options)
+    return True
+
+
 def interactive_mode():
     """Simple interactive mode for easy usage"""
     print("User Engagement Analytics")